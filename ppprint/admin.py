@@ -1,15 +1,51 @@
 from django.contrib import admin
+from django.http import HttpResponse
+from django.utils.html import format_html, format_html_join
 
-from ppprint.models import ImportJob, VisualizationJob
+from ppprint.models import ImportJob, Measurement, VisualizationJob
+from ppprint.profiling import job_profile, prometheus_text
 
 
-class ImportJobAdmin(admin.ModelAdmin):
+class JobAdmin(admin.ModelAdmin):
+    readonly_fields = ["profile"]
+    actions = ["export_metrics"]
+
+    @admin.display(description="Profile")
+    def profile(self, obj):
+        """Table of the timings and memory of all stages of the job."""
+
+        rows = format_html_join(
+            "",
+            "<tr><td>{}</td><td>{}</td><td>{:.2f}</td><td>{:.2f}</td><td>{:.1f}</td></tr>",
+            (
+                (stage, calls, wall_time, cpu_time, peak_rss / 1024**2)
+                for stage, (calls, wall_time, cpu_time, peak_rss) in sorted(
+                    job_profile(obj).stages.items(), key=lambda item: -item[1][1]
+                )
+            ),
+        )
+        return format_html(
+            "<table><tr><th>Stage</th><th>Calls</th><th>Wall time (s)</th><th>CPU time (s)</th>"
+            "<th>Peak RSS (MiB)</th></tr>{}</table>",
+            rows,
+        )
+
+    @admin.action(description="Export metrics of the selected jobs")
+    def export_metrics(self, request, queryset):
+        return HttpResponse(
+            prometheus_text(queryset.prefetch_related("measurements")),
+            content_type="text/plain; version=0.0.4",
+        )
+
+
+class ImportJobAdmin(JobAdmin):
     pass
 
 
-class VisualizationJobAdmin(admin.ModelAdmin):
+class VisualizationJobAdmin(JobAdmin):
     pass
 
 
 admin.site.register(ImportJob, ImportJobAdmin)
 admin.site.register(VisualizationJob, VisualizationJobAdmin)
+admin.site.register(Measurement)
@@ -4,6 +4,8 @@ from celery import Celery
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ppprint.settings")
+# Plots are only rendered to files, without a GUI (also for the webserver, which imports this module first)
+os.environ.setdefault("MPLBACKEND", "Agg")
 
 app = Celery("ppprint")
 
@@ -1,6 +1,7 @@
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Div, Field
 from django import forms
+from django.conf import settings
 
 from ppprint.models import ImportJob, StatusChoices, VisualizationJob
 from ppprint.validators import limit_num_choices, validate_color
@@ -58,7 +59,7 @@ class SelectionForm(forms.ModelForm):
 
     sources = MyModelMultipleChoiceField(
         queryset=ImportJob.objects.filter(status=StatusChoices.SUCCESS),
-        validators=[limit_num_choices(4)],
+        validators=[limit_num_choices(settings.PPPRINT_MAX_PROTEOMES)],
     )
 
     class Meta:
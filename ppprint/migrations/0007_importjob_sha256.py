@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-17 23:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ppprint', '0006_message_importjob_messages_visualizationjob_messages'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.0.2 on 2026-10-17 23:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ppprint', '0007_importjob_sha256'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Measurement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage', models.CharField(max_length=200)),
+                ('calls', models.PositiveIntegerField(default=1)),
+                ('wall_time', models.FloatField()),
+                ('cpu_time', models.FloatField()),
+                ('peak_rss', models.BigIntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='measurements',
+            field=models.ManyToManyField(to='ppprint.Measurement'),
+        ),
+        migrations.AddField(
+            model_name='visualizationjob',
+            name='measurements',
+            field=models.ManyToManyField(to='ppprint.Measurement'),
+        ),
+    ]
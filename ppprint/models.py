@@ -18,6 +18,19 @@ class Message(models.Model):
     text = models.TextField()
 
 
+class Measurement(models.Model):
+    """Wall time and CPU time of a stage of a job summed over all runs of the stage, and the highest peak RSS of them."""
+
+    stage = models.CharField(max_length=200)
+    calls = models.PositiveIntegerField(default=1)
+    wall_time = models.FloatField()
+    cpu_time = models.FloatField()
+    peak_rss = models.BigIntegerField()
+
+    def __str__(self):
+        return f"{self.stage}: {self.wall_time:.2f} s"
+
+
 class Job(models.Model):
     status = models.CharField(
         max_length=7, choices=StatusChoices.choices, default=StatusChoices.CREATED
@@ -26,11 +39,16 @@ class Job(models.Model):
         auto_now_add=True,
     )
     messages = models.ManyToManyField(Message)
+    measurements = models.ManyToManyField(Measurement)
 
     def add_message(self, text):
         if text:
             self.messages.add(Message.objects.create(text=text))
 
+    def add_messages(self, texts):
+        messages = Message.objects.bulk_create(Message(text=text) for text in texts if text)
+        self.messages.add(*messages)
+
     class Meta:
         abstract = True
 
@@ -40,6 +58,8 @@ class ImportJob(Job):
     color = models.CharField(
         max_length=7, blank=True, default="", validators=[validate_color]
     )
+    # SHA-256 of the uploaded archive, used to look up results of identical uploads
+    sha256 = models.CharField(max_length=64, blank=True, default="", db_index=True)
 
     def __str__(self):
         return f"Proteome: {self.name}"
@@ -0,0 +1,92 @@
+"""
+Content-addressed store of import results,
+so that re-uploads of an identical archive do not need to be parsed again.
+"""
+
+import hashlib
+import os
+import shutil
+from pathlib import Path
+from typing import Iterator, Optional
+
+from django.conf import settings
+from django.core.files import File
+
+from ppprint.preprocessing.store import MANIFEST, has_results, read_manifest
+
+# Bump whenever parsing or extraction changes the results of an archive, invalidating all cached results
+CACHE_VERSION = 4
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class HashingFile(File):
+    """Computes the SHA-256 digest of a file while its chunks are read, e.g. when saved to the storage."""
+
+    def __init__(self, file, name: Optional[str] = None):
+        super().__init__(file, name)
+        self.hash = hashlib.sha256()
+
+    def chunks(self, chunk_size: Optional[int] = None) -> Iterator[bytes]:
+        for chunk in super().chunks(chunk_size):
+            self.hash.update(chunk)
+            yield chunk
+
+    def hexdigest(self) -> str:
+        return self.hash.hexdigest()
+
+
+def hash_file(path: Path) -> str:
+    """Returns the SHA-256 digest of a file, reading it in chunks."""
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_cache_path(digest: str) -> Path:
+    return (
+        Path(settings.BASE_DIR)
+        / settings.MEDIA_ROOT
+        / "import_cache"
+        / f"v{CACHE_VERSION}"
+        / digest
+    )
+
+
+def link_or_copy(src: Path, dst: Path):
+    """Hard links `src` to `dst` (copies it if linking fails), replacing `dst` atomically."""
+
+    tmp = dst.with_name(f".{dst.name}.{os.getpid()}")
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+def link_results(src: Path, dst: Path):
+    """Links all files of the results in folder `src` to folder `dst`, the manifest last."""
+
+    dst.mkdir(parents=True, exist_ok=True)
+    for entry in read_manifest(src)["frames"].values():
+        link_or_copy(src / entry["file"], dst / entry["file"])
+    link_or_copy(src / MANIFEST, dst / MANIFEST)
+
+
+def restore_results(digest: str, result_folder: Path) -> bool:
+    """Links cached results of an identical archive to `result_folder`. Returns whether there were any."""
+
+    cache_path = get_cache_path(digest)
+    if not has_results(cache_path):
+        return False
+    link_results(cache_path, result_folder)
+    return True
+
+
+def cache_results(digest: str, result_folder: Path):
+    """Adds the results of an archive to the cache."""
+
+    link_results(result_folder, get_cache_path(digest))
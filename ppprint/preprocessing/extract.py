@@ -5,12 +5,25 @@ split by feature and base (region/protein).
 
 
 import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 
+from ppprint.profiling import measure
+
+# Compact dtypes of the extraction results: positions, lengths and protein ids, other values and labels
+INT = "int32"
+FLOAT = "float32"
+CATEGORY = "category"
+# Fractions of residues keep double precision, as the KDEs of their (often degenerate) distributions need it
+FRACTION = "float64"
+FRACTIONS = {"region content", "I", "O", "M", "H", "E", "DBR content", "PBR content", "RBR content"}
+
+FEATURES = ["tmseg", "mdisorder", "prona", "reprof"]
+
 
 def read_json(path: Path) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """Reads the proteome-specific JSON with all features into a dataframe with rows corresponding to regions."""
@@ -29,12 +42,7 @@ def read_json(path: Path) -> Tuple[pd.DataFrame, pd.DataFrame]:
             seq = p["sequence"]
             sequences.append(seq)
             # TODO: add features here!
-            for feature in [
-                "tmseg",
-                "mdisorder",
-                "prona",
-                "reprof",
-            ]:
+            for feature in FEATURES:
                 for region in p[feature]:
                     yield (
                         i,
@@ -47,6 +55,7 @@ def read_json(path: Path) -> Tuple[pd.DataFrame, pd.DataFrame]:
     df = pd.DataFrame(
         get_data(), columns=["protein", "feature", "begin", "end", "description"]
     )
+    df["feature"] = pd.Categorical(df["feature"], categories=FEATURES)
 
     # Store extracted sequences in a separate dataframe and extract lengths
     df_seq = pd.DataFrame(sequences, columns=["sequence"])
@@ -55,6 +64,44 @@ def read_json(path: Path) -> Tuple[pd.DataFrame, pd.DataFrame]:
     return df, df_seq
 
 
+def read_data(path: Path) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Reads the proteome-specific columnar regions and sequences tables into dataframes with rows corresponding to regions."""
+
+    with np.load(path) as data:
+        df = pd.DataFrame(
+            {
+                "protein": data["protein"].astype("int64"),
+                "feature": pd.Categorical.from_codes(data["feature"], data["features"].tolist()),
+                "begin": data["begin"].astype("int64"),
+                "end": data["end"].astype("int64"),
+                "description": data["descriptions"][data["description"]].astype(object),
+            }
+        )
+
+        # Sequences are stored back to back, each one ends at its offset
+        sequences = data["sequences"].tobytes()
+        offsets = data["sequence_offsets"]
+        df_seq = pd.DataFrame(
+            {
+                "sequence": [
+                    sequences[begin:end].decode()
+                    for begin, end in zip(offsets[:-1], offsets[1:])
+                ],
+                "protein length": data["protein_length"].astype("int64"),
+            }
+        )
+
+    return df, df_seq
+
+
+def read_source(path: Path) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Reads the source dataframes from either the columnar (.npz) or the JSON intermediate format."""
+
+    read = read_data if path.suffix == ".npz" else read_json
+    with measure(read.__name__):
+        return read(path)
+
+
 def extract_pbased_mdisorder(
     df_source,
     *args,
@@ -73,23 +120,27 @@ def extract_pbased_mdisorder(
 
     df_new = df_new.astype(
         {
-            "number of regions": "int64",
-            "median length": "float64",
-            "sum region lengths": "int64",
-            "protein length": "int64",
-            "region content": "float64",
+            "number of regions": INT,
+            "median length": FLOAT,
+            "sum region lengths": INT,
+            "protein length": INT,
+            "region content": FRACTION,
         }
     )
     return df_new
 
 
-def extract_pbased_tmseg(df_source: pd.DataFrame, *args, **kwargs):
-    """Extracts protein-based data for tmseg.
-    First, extracts proteins with signal peptides to apply index shifting of all contained regions.
-    Then, performs common data extraction and clips protein length and calculates correct region content.
+def shift_signal_peptides(df_source: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Shifts the indices of all regions of proteins with a signal peptide by the length of the signal peptide.
+    Returns the shifted regions and the shift size per protein. Regions that were already shifted are kept as is.
     """
 
-    # Extract signal peptide containing proteins and shift the indices of their regions
+    if "shift size" in df_source:
+        df_sig = df_source[df_source["description"] == "Signal Peptide"][["protein", "shift size"]]
+        df_sig = df_sig.astype({"shift size": df_source["region length"].dtype})
+        return df_source, df_sig.drop_duplicates("protein").set_index("protein")
+
     df_sig = df_source[df_source["description"] == "Signal Peptide"].drop_duplicates(
         "protein"
     )[["protein", "region length"]]
@@ -98,6 +149,53 @@ def extract_pbased_tmseg(df_source: pd.DataFrame, *args, **kwargs):
     df_source["begin"] = df_source["begin"] - df_source["shift size"]
     df_source["end"] = df_source["end"] - df_source["shift size"]
 
+    return df_source, df_sig
+
+
+def tmseg_topology(df_source: pd.DataFrame) -> pd.DataFrame:
+    """
+    Determines the topology of all TM proteins (TMPs) at once from the order of their regions:
+    position of the first TMH, class of the N-terminal region and orientation (region before the first TMH,
+    "Membrane" if the protein starts with a TMH). Proteins without TMH are not included.
+    """
+
+    # Regions of each protein in their original order (as grouped by `groupby`)
+    order = np.argsort(df_source["protein"].to_numpy(), kind="stable")
+    proteins = df_source["protein"].to_numpy()[order]
+    descriptions = df_source["description"].to_numpy(dtype=object)[order]
+
+    def first_of_runs(values: np.ndarray) -> np.ndarray:
+        """Returns a mask of the first element of each run of equal values."""
+        mask = np.ones(len(values), dtype=bool)
+        mask[1:] = values[1:] != values[:-1]
+        return mask
+
+    starts = np.flatnonzero(first_of_runs(proteins))
+    tmhs = np.flatnonzero(descriptions == "Transmembrane Helix")
+    # First TMH of each protein
+    tmhs = tmhs[first_of_runs(proteins[tmhs])]
+    protein_starts = starts[np.searchsorted(proteins[starts], proteins[tmhs])]
+
+    first = tmhs - protein_starts
+    return pd.DataFrame(
+        {
+            "first TMH": first,
+            "N-terminal region": descriptions[protein_starts],
+            "orientation": np.where(first == 0, "Membrane", descriptions[tmhs - 1]),
+        },
+        index=pd.Index(proteins[tmhs], name="protein"),
+    )
+
+
+def extract_pbased_tmseg(df_source: pd.DataFrame, *args, **kwargs):
+    """Extracts protein-based data for tmseg.
+    First, extracts proteins with signal peptides to apply index shifting of all contained regions.
+    Then, performs common data extraction and clips protein length and calculates correct region content.
+    """
+
+    # Extract signal peptide containing proteins and shift the indices of their regions
+    df_source, df_sig = shift_signal_peptides(df_source)
+
     # Exclude TMH regions that do not fulfill minlength requirement
     minlength = kwargs.pop("minlength")
     df_source = df_source[
@@ -129,45 +227,23 @@ def extract_pbased_tmseg(df_source: pd.DataFrame, *args, **kwargs):
     df_new["M"] = df_new["M"] / df_new["protein length"]
     df_new["O"] = df_new["O"] / df_new["protein length"]
 
-    def orientation(df):
-        """Determines the orientation for each (TM) protein."""
-
-        df = df.reset_index()
-        indices = df.index[df["description"] == "Transmembrane Helix"].tolist()
-        if not indices:
-            # All TMHs did not fulfill minlength requirement
-            return ""
-        first = indices[0]
-        if first == 0:
-            # The first region is the helix -> N-terminus of protein is in membrane
-            return "Membrane"
-        return str(df.at[first - 1, "description"])
-
-    # Filter to TMPs, because it is possible that regions of proteins without TMH are in df_source, need orientation 0
-    df_tmp = df_source[
-        df_source["description"] == "Transmembrane Helix"
-    ].drop_duplicates("protein")["protein"]
-    df_source = df_source[df_source["protein"].isin(df_tmp)]
-
     # Compute the orientation for all TMPs
-    orientation_series = df_source.groupby("protein").apply(
-        func=orientation,
-    )
-    orientation_series.name = "orientation"
+    orientation_series = tmseg_topology(df_source)["orientation"]
     df_new = df_new.join(orientation_series, how="left").fillna(0)
+    df_new["orientation"] = df_new["orientation"].astype(str)
 
     df_new = df_new.astype(
         {
-            "number of regions": "int64",
-            "median length": "float64",
-            "sum region lengths": "int64",
-            "protein length": "int64",
-            "shift size": "int64",
-            "region content": "float64",
-            "I": "float64",
-            "O": "float64",
-            "M": "float64",
-            "orientation": "str",
+            "number of regions": INT,
+            "median length": FLOAT,
+            "sum region lengths": INT,
+            "protein length": INT,
+            "shift size": INT,
+            "region content": FRACTION,
+            "I": FRACTION,
+            "O": FRACTION,
+            "M": FRACTION,
+            "orientation": CATEGORY,
         }
     )
     return df_new
@@ -240,17 +316,17 @@ def extract_pbased_prona(df_source: pd.DataFrame, *args, **kwargs):
 
     df_new = df_new.astype(
         {
-            "number of regions": "int64",
-            "median length": "float64",
-            "sum region lengths": "int64",
-            "protein length": "int64",
-            "region content": "float64",
-            "DBR content": "float64",
-            "PBR content": "float64",
-            "RBR content": "float64",
-            "num DBR": "int64",
-            "num PBR": "int64",
-            "num RBR": "int64",
+            "number of regions": INT,
+            "median length": FLOAT,
+            "sum region lengths": INT,
+            "protein length": INT,
+            "region content": FRACTION,
+            "DBR content": FRACTION,
+            "PBR content": FRACTION,
+            "RBR content": FRACTION,
+            "num DBR": INT,
+            "num PBR": INT,
+            "num RBR": INT,
         }
     )
 
@@ -296,14 +372,14 @@ def extract_pbased_reprof(df_source: pd.DataFrame, *args, **kwargs):
 
     df_new = df_new.astype(
         {
-            "number of regions": "int64",
-            "median length": "float64",
-            "sum region lengths": "int64",
-            "protein length": "int64",
-            "region content": "float64",
-            "H": "float64",
-            "O": "float64",
-            "E": "float64",
+            "number of regions": INT,
+            "median length": FLOAT,
+            "sum region lengths": INT,
+            "protein length": INT,
+            "region content": FRACTION,
+            "H": FRACTION,
+            "O": FRACTION,
+            "E": FRACTION,
         }
     )
 
@@ -340,31 +416,11 @@ def extract_pbased_all(
 def extract_pbased(df_source: pd.DataFrame, df_seq: pd.DataFrame):
     """Maps required extraction parameters to each feature and collects p-based extraction results."""
 
-    # Store function and required params for each feature
-    mapping = {
-        "tmseg": (
-            extract_pbased_tmseg,
-            {"minlength": 12, "region_type": ["Transmembrane Helix"]},
-        ),
-        "mdisorder": (extract_pbased_mdisorder, {"minlength": 30}),
-        "prona": (
-            extract_pbased_prona,
-            {"minlength": 6, "region_type": ["Protein Binding (RI: 67-100)"]},
-        ),
-        "reprof": (extract_pbased_reprof, {"minlength": 4, "region_type": ["Helix"]}),
+    features = partition_features(df_source)
+    return {
+        f"{feature} pbased": extract_feature(features[feature], df_seq, *PBASED[feature])
+        for feature in PBASED
     }
-    results = {}
-
-    for feature, (func, kwargs) in mapping.items():
-        # Reduce source dataframe to feature and calculate region lengths
-        df_curr = df_source[df_source["feature"] == feature]
-        df_curr["region length"] = df_curr["end"] - df_curr["begin"] + 1
-
-        # Perform feature-specific extraction and store pbased results
-        df_p = func(df_curr, df_seq, **kwargs)
-        results[f"{feature} pbased"] = df_p
-
-    return results
 
 
 def extract_rbased_mdisorder(df_source: pd.DataFrame, *args, **kwargs):
@@ -378,13 +434,7 @@ def extract_rbased_tmseg(df_source: pd.DataFrame, *args, **kwargs):
     """"""
 
     # Extract signal peptide containing proteins and shift the indices of their regions
-    df_sig = df_source[df_source["description"] == "Signal Peptide"].drop_duplicates(
-        "protein"
-    )[["protein", "region length"]]
-    df_sig = df_sig.rename(columns={"region length": "shift size"}).set_index("protein")
-    df_source = df_source.join(df_sig, how="left", on="protein").fillna(0)
-    df_source["begin"] = df_source["begin"] - df_source["shift size"]
-    df_source["end"] = df_source["end"] - df_source["shift size"]
+    df_source, df_sig = shift_signal_peptides(df_source)
 
     # Clip protein length (if signal peptide present, else clip == 0) in sequences dataframe
     df_seq = args[0]
@@ -422,72 +472,155 @@ def extract_rbased_all(
     df_source = df_source[df_source["region length"] >= minlength]
 
     # Build region and length from begin and end
-    df_new = pd.DataFrame()
-    df_new["protein"] = df_source["protein"]
-    df_source["reg length"] = df_source["end"] - df_source["begin"] + 1
-    df_source["region"] = df_source[["begin", "end"]].apply(tuple, axis=1)
-    df_new = df_new.join(df_source[["region", "reg length"]], how="left").fillna(0)
+    df_new = df_source[["protein", "begin", "end"]].copy()
+    df_new["reg length"] = df_new["end"] - df_new["begin"] + 1
     # Add description (relevant if multiple types allowed)
-    df_new = df_new.join(df_source["description"], how="left").fillna(0)
+    df_new["description"] = df_source["description"]
 
     # Calculate point region
-    df_source = df_source.join(
-        df_seq["protein length"], on="protein", how="left"
-    ).fillna(0)
-    df_source["point region"] = (
-        df_source[["begin", "end"]]
-        .div(df_source["protein length"].values, axis=0)
-        .apply(tuple, axis=1)
-    )
+    protein_length = df_seq["protein length"].reindex(df_new["protein"]).fillna(0).to_numpy()
+    df_new["point begin"] = df_new["begin"] / protein_length
+    df_new["point end"] = df_new["end"] / protein_length
 
     # Add protein length and calculate relative region length
-    df_new = df_new.join(
-        df_source[["point region", "protein length"]], how="left"
-    ).fillna(0)
+    df_new["protein length"] = protein_length
     df_new["rel reg length"] = df_new["reg length"] / df_new["protein length"]
 
     return df_new
 
 
+def upgrade_rbased(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts an r-based dataframe of an old import, with "region" and "point region" tuple columns,
+    to the current schema with separate begin and end columns. Current dataframes are returned as is.
+    """
+
+    if "region" not in df.columns:
+        return df
+
+    df = df.copy()
+    region = np.array(df.pop("region").tolist(), dtype=float).reshape(-1, 2)
+    point_region = np.array(df.pop("point region").tolist(), dtype=float).reshape(-1, 2)
+    df.insert(1, "begin", region[:, 0].astype("int64"))
+    df.insert(2, "end", region[:, 1].astype("int64"))
+    df.insert(5, "point begin", point_region[:, 0])
+    df.insert(6, "point end", point_region[:, 1])
+    return df
+
+
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Converts a dataframe of an old import to the compact dtypes of the current extraction results."""
+
+    dtypes = {}
+    for column, dtype in df.dtypes.items():
+        if pd.api.types.is_integer_dtype(dtype):
+            dtypes[column] = INT
+        elif pd.api.types.is_float_dtype(dtype):
+            dtypes[column] = FRACTION if column in FRACTIONS else FLOAT
+        elif pd.api.types.is_object_dtype(dtype):
+            dtypes[column] = CATEGORY
+    return df.astype(dtypes)
+
+
 def extract_rbased(df_source: pd.DataFrame, df_seq: pd.DataFrame):
     """Maps required extraction parameters to each feature and collects r-based extraction results."""
 
-    # Store function and required params for each feature
-    mapping = {
-        "tmseg": (
-            extract_rbased_tmseg,
-            {"minlength": 12, "region_type": ["Transmembrane Helix"]},
-        ),
-        "mdisorder": (extract_rbased_mdisorder, {"minlength": 30}),
-        "prona": (
-            extract_rbased_prona,
-            {"minlength": 6, "region_type": ["Protein Binding (RI: 67-100)"]},
-        ),
-        "reprof": (
-            extract_rbased_reprof,
-            {"minlength": 4, "region_type": ["Helix", "Strand"]},
-        ),
+    features = partition_features(df_source)
+    return {
+        f"{feature} rbased": extract_feature(
+            features[feature], df_seq, *RBASED[feature], RBASED_DTYPES
+        )
+        for feature in RBASED
     }
-    results = {}
 
-    for feature, (func, kwargs) in mapping.items():
-        # Reduce source dataframe to feature and calculate region lengths
-        df_curr = df_source[df_source["feature"] == feature]
-        df_curr["region length"] = df_curr["end"] - df_curr["begin"] + 1
 
-        # Perform feature-specific extraction and store pbased results
-        df_r = func(df_curr, df_seq, **kwargs)
-        df_r = df_r.astype(
-            {
-                "protein": "int64",
-                #"region": "float64",
-                "reg length": "int64",
-                "description": "str",
-                #"point region": "float64",
-                "protein length": "int64",
-                "rel reg length": "float64",
-            }
-        )
-        results[f"{feature} rbased"] = df_r
+# Store function and required params for each feature
+PBASED = {
+    "tmseg": (
+        extract_pbased_tmseg,
+        {"minlength": 12, "region_type": ["Transmembrane Helix"]},
+    ),
+    "mdisorder": (extract_pbased_mdisorder, {"minlength": 30}),
+    "prona": (
+        extract_pbased_prona,
+        {"minlength": 6, "region_type": ["Protein Binding (RI: 67-100)"]},
+    ),
+    "reprof": (extract_pbased_reprof, {"minlength": 4, "region_type": ["Helix"]}),
+}
+RBASED = {
+    "tmseg": (
+        extract_rbased_tmseg,
+        {"minlength": 12, "region_type": ["Transmembrane Helix"]},
+    ),
+    "mdisorder": (extract_rbased_mdisorder, {"minlength": 30}),
+    "prona": (
+        extract_rbased_prona,
+        {"minlength": 6, "region_type": ["Protein Binding (RI: 67-100)"]},
+    ),
+    "reprof": (
+        extract_rbased_reprof,
+        {"minlength": 4, "region_type": ["Helix", "Strand"]},
+    ),
+}
+RBASED_DTYPES = {
+    "protein": INT,
+    "begin": INT,
+    "end": INT,
+    "reg length": INT,
+    "description": CATEGORY,
+    "point begin": FLOAT,
+    "point end": FLOAT,
+    "protein length": INT,
+    "rel reg length": FLOAT,
+}
+
+
+def partition_features(df_source: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    Splits the regions into one dataframe per feature in a single pass.
+    Derived columns needed by both bases are added once: region lengths and, for tmseg, the signal peptide shift.
+    """
+
+    df_source = df_source.assign(**{"region length": df_source["end"] - df_source["begin"] + 1})
+    partitions = dict(tuple(df_source.groupby("feature", sort=False, observed=True)))
+    features = {feature: partitions.get(feature, df_source.iloc[:0]) for feature in PBASED}
+    features["tmseg"], _ = shift_signal_peptides(features["tmseg"])
+
+    return features
+
+
+def extract_feature(
+    df_curr: pd.DataFrame,
+    df_seq: pd.DataFrame,
+    func: Callable,
+    kwargs: Dict,
+    dtypes: Optional[Dict[str, str]] = None,
+):
+    """Performs a feature-specific extraction on the regions of that feature."""
+
+    with measure(func.__name__, per_thread=True):
+        df = func(df_curr, df_seq, **kwargs)
+        return df.astype(dtypes) if dtypes else df
+
+
+def extract_all(
+    df_source: pd.DataFrame, df_seq: pd.DataFrame, workers: int = 1
+) -> Dict[str, pd.DataFrame]:
+    """
+    Collects p-based and r-based extraction results of all features, partitioning the regions only once.
+    With more than one worker, the extractions run concurrently in a thread pool.
+    """
+
+    features = partition_features(df_source)
+    tasks = {
+        f"{feature} {base}": (features[feature], df_seq, *extractors[feature], dtypes)
+        for base, extractors, dtypes in [("pbased", PBASED, None), ("rbased", RBASED, RBASED_DTYPES)]
+        for feature in extractors
+    }
+
+    if workers <= 1:
+        return {name: extract_feature(*task) for name, task in tasks.items()}
 
-    return results
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {name: executor.submit(extract_feature, *task) for name, task in tasks.items()}
+        return {name: future.result() for name, future in futures.items()}
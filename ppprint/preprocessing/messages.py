@@ -0,0 +1,98 @@
+"""
+Collects user-facing warnings of an import in memory,
+so that they can be aggregated and written to the database at once.
+"""
+
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from django.conf import settings
+
+from ppprint.models import ImportJob
+
+
+class MessageCollector:
+    """
+    Deduplicates and aggregates messages by a summary, e.g. "proteins missing .reprof".
+    Only the first few examples of every summary are kept.
+    """
+
+    def __init__(self, max_examples: Optional[int] = None):
+        if max_examples is None:
+            max_examples = settings.PPPRINT_MESSAGE_EXAMPLES
+        self.max_examples = max_examples
+        # Maps a summary to the number of occurrences, the first full message and some examples
+        self.groups: Dict[str, List] = {}
+
+    def __len__(self):
+        return sum(count for count, _, _ in self.groups.values())
+
+    def add(self, text: str, summary: Optional[str] = None, example: Optional[str] = None):
+        """
+        Records a message. `text` is reported as is if the message only occurs once,
+        otherwise all messages with the same `summary` are reported together.
+        """
+
+        if not text:
+            return
+        group = self.groups.setdefault(summary or text, [0, text, []])
+        group[0] += 1
+        if example is not None and len(group[2]) < self.max_examples:
+            group[2].append(example)
+
+    def update(self, other: "MessageCollector"):
+        """Merges the messages of another collector (e.g. of a worker process) into this one."""
+
+        for summary, (count, text, examples) in other.groups.items():
+            group = self.groups.setdefault(summary, [0, text, []])
+            group[0] += count
+            group[2].extend(examples[: self.max_examples - len(group[2])])
+
+    def clear(self):
+        """Drops all messages, e.g. of a run that is repeated."""
+
+        self.groups.clear()
+
+    def texts(self) -> List[str]:
+        """Returns one message per summary, in order of first occurrence."""
+
+        texts = []
+        for summary, (count, text, examples) in self.groups.items():
+            if count == 1:
+                texts.append(text)
+            elif summary == text:
+                texts.append(f"{text} ({count:,} times)")
+            else:
+                end = ", ..." if count > len(examples) else "."
+                texts.append(f"{count:,} {summary}, e.g. {', '.join(examples)}{end}")
+        return texts
+
+
+# Messages of the ImportJobs running in this process, while they are collected by `collecting`
+collectors: Dict[int, MessageCollector] = {}
+
+
+def get_collector(import_job_pk: int) -> MessageCollector:
+    """Returns the collector of a running ImportJob. Messages outside of `collecting` are dropped."""
+
+    return collectors.get(import_job_pk, MessageCollector())
+
+
+@contextmanager
+def collecting(import_job_pk: int) -> Iterator[MessageCollector]:
+    """Collects the messages of an ImportJob within the block and stores them once it is left, also if it fails."""
+
+    collector = collectors[import_job_pk] = MessageCollector()
+    try:
+        yield collector
+    finally:
+        del collectors[import_job_pk]
+        flush_messages(import_job_pk, collector)
+
+
+def flush_messages(import_job_pk: int, collector: MessageCollector):
+    """Writes all collected messages of an ImportJob to the database with a single bulk insert."""
+
+    if collector:
+        ij = ImportJob.objects.get(pk=import_job_pk)
+        ij.add_messages(collector.texts())
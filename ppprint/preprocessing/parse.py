@@ -4,19 +4,32 @@ This is mostly copypasta of `pp_to_json.py`, but for whole proteomes,
 tailored to be used by ppprint.
 """
 
+import io
 import os
-import json
 import logging
 import pathlib
-from itertools import chain, groupby
-from pathlib import Path
-from typing import List, Callable
-from ppprint.preprocessing.utils import LoggedException
+import tarfile
+from collections import deque
+from itertools import islice
+from pathlib import Path, PurePosixPath
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from billiard.pool import Pool
+from django.conf import settings
 
-from ppprint.models import ImportJob
+from ppprint.preprocessing.messages import MessageCollector, get_collector
+from ppprint.preprocessing.utils import LoggedException
+from ppprint.profiling import Profile, measure, merge, recording
 
 logger = logging.getLogger(__name__)
 
+# File extensions of all PredictProtein outputs read by ppprint
+EXTENSIONS = ("fasta", "tmseg", "prona", "mdisorder", "reprof")
+
+# Features in the order of the regions table written by `write_data`
+FEATURES = ("tmseg", "mdisorder", "prona", "reprof")
+
 
 class SequenceException(Exception):
     pass
@@ -36,38 +49,38 @@ def retry_with_latin(f: Callable[..., List]):
     return inner
 
 
-def group_segments(annotation):
-    """Groups all consecutive elements of the same value in
-    an annotation string and records the positions.
+def group_segments(annotation, type_dict: Dict) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Groups all consecutive elements of the same value in an annotation (string or sequence of class codes)
+    and records the positions in one vectorized pass.
+    Returns begin, end and type arrays of all segments whose type is a key of `type_dict`.
     """
 
-    position = 1
-
-    for type, g in groupby(annotation):
-        # Amount of elements of the same value
-        length = len(list(g))
-        segment = dict()
-
-        segment["type"] = type
-        segment["begin"] = position
-        segment["end"] = position + length - 1
-
-        position = position + length
+    codes = np.asarray(list(annotation) if isinstance(annotation, str) else annotation)
+    if codes.size == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int), codes
 
-        yield segment
+    # Indices at which a new segment starts
+    starts = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+    begins = np.concatenate(([0], starts))
+    ends = np.concatenate((starts, [codes.size])) - 1
+    types = codes[begins]
 
+    # Only allow the regions of a set of pre-defined types
+    allowed = np.isin(types, list(type_dict))
 
-def filter_segments(segments, type_dict):
-    """Sets type and description on filtered segments."""
+    # Positions are 1-based
+    return begins[allowed] + 1, ends[allowed] + 1, types[allowed]
 
-    # Only allow the regions of a set of pre-defined types
-    segments = [s for s in segments if s["type"] in type_dict]
 
-    # According to type, set pre-defined description
-    for segment in segments:
-        segment["description"] = type_dict[segment.pop("type")]
+def filter_segments(segments: Tuple[np.ndarray, np.ndarray, np.ndarray], type_dict: Dict) -> List:
+    """Builds the (already filtered) segments and sets the pre-defined description according to their type."""
 
-    return segments
+    begins, ends, types = segments
+    return [
+        {"begin": begin, "end": end, "description": type_dict[type]}
+        for begin, end, type in zip(begins.tolist(), ends.tolist(), types.tolist())
+    ]
 
 
 def get_sequence(path: Path) -> str:
@@ -115,8 +128,6 @@ def parse_tmseg(path: Path, encoding="utf-8") -> List:
         # Annotation string is not present or does not fit sequence
         return []
 
-    segments = group_segments(annotation)
-
     type_dict = {
         "S": "Signal Peptide",
         "H": "Transmembrane Helix",
@@ -124,7 +135,7 @@ def parse_tmseg(path: Path, encoding="utf-8") -> List:
         "2": "Extracellular",
     }
 
-    return filter_segments(segments, type_dict)
+    return filter_segments(group_segments(annotation, type_dict), type_dict)
 
 
 @retry_with_latin
@@ -198,10 +209,6 @@ def parse_prona(path: Path, encoding="utf-8") -> List:
                 else:
                     break
 
-    segments = chain(
-        group_segments(prona_pro), group_segments(prona_dna), group_segments(prona_rna)
-    )
-
     type_dict = {
         "P0": "Protein Binding (RI: 00-33)",
         "P1": "Protein Binding (RI: 34-66)",
@@ -214,6 +221,13 @@ def parse_prona(path: Path, encoding="utf-8") -> List:
         "R2": "RNA Binding (RI: 67-100)",
     }
 
+    segments = [
+        group_segments(annotation, type_dict)
+        for annotation in (prona_pro, prona_dna, prona_rna)
+    ]
+    # Concatenate begin, end and type arrays of all three binding types
+    segments = tuple(np.concatenate(arrays) for arrays in zip(*segments))
+
     return filter_segments(segments, type_dict)
 
 
@@ -239,11 +253,9 @@ def parse_mdisorder(path: Path, encoding="utf-8") -> List:
                 data = line.split()
                 num_col = len(data)
 
-    segments = group_segments(mdisorder)
-
     type_dict = {"D": "Disordered Region"}
 
-    return filter_segments(segments, type_dict)
+    return filter_segments(group_segments(mdisorder, type_dict), type_dict)
 
 
 @retry_with_latin
@@ -270,41 +282,36 @@ def parse_reprof(path: Path, encoding="utf-8") -> List:
                 data = line.split()
                 num_col = len(data)
 
-    segments = group_segments(structure)
-
     type_dict = {
         "H": "Helix",
         "E": "Strand",
         "L": "Other",
     }
 
-    return filter_segments(segments, type_dict)
-
+    return filter_segments(group_segments(structure, type_dict), type_dict)
 
-def handle_exception(import_job_pk: int, message: str):
-    ij = ImportJob.objects.get(pk=import_job_pk)
-    ij.add_message(message)
 
-
-def parse_protein(base_path: Path, protein: str, import_job_pk: int):
-    """Parses information for a given protein."""
+def parse_protein(base_path: Path, protein: str, messages: MessageCollector):
+    """Parses information for a given protein. Missing or unparseable files are recorded in `messages`."""
 
     def run(f, extension: str):
         """Runs a parser function with the specified file extension."""
 
         path = base_path / f"{protein}.{extension}"
+        example = f"{protein} in {base_path.name}"
 
         if path.exists():
             try:
-                return f(path)
+                with measure(f"parse {extension}"):
+                    return f(path)
             except SequenceException as exc:
-                handle_exception(import_job_pk, exc.args[0])
+                messages.add(exc.args[0], "FASTA files with more than one sequence", example)
             except Exception:
                 m = f"Could not PARSE {protein}.{extension} in {base_path.name}."
-                handle_exception(import_job_pk, m)
+                messages.add(m, f"proteins with unparseable .{extension}", example)
         else:
             m = f"Could not FIND {protein}.{extension} in {base_path.name}."
-            handle_exception(import_job_pk, m)
+            messages.add(m, f"proteins missing .{extension}", example)
 
         return []
 
@@ -330,39 +337,223 @@ def parse_protein(base_path: Path, protein: str, import_job_pk: int):
     return (sequence, tmseg, prona, mdisorder, reprof)
 
 
+class ArchiveFile:
+    """In-memory member of a tar archive, providing the part of the `Path` interface used by the parsers."""
+
+    def __init__(self, name: str, content: Optional[bytes]):
+        self.name = name
+        self.content = content
+
+    def __str__(self):
+        return self.name
+
+    def exists(self) -> bool:
+        return self.content is not None
+
+    def open(self, mode="r", encoding="utf-8", errors="strict"):
+        return io.TextIOWrapper(io.BytesIO(self.content), encoding=encoding, errors=errors)
+
+
+class ArchiveFolder:
+    """Job folder of a tar archive, providing the part of the `Path` interface used by `parse_protein`."""
+
+    def __init__(self, name: str, files: Dict[str, bytes]):
+        self.name = name
+        self.files = files
+
+    def __truediv__(self, file_name: str) -> ArchiveFile:
+        return ArchiveFile(f"{self.name}/{file_name}", self.files.get(file_name))
+
+    def proteins(self) -> List[str]:
+        """Identifies the proteins based on the present .fasta files."""
+        return [PurePosixPath(name).stem for name in self.files if name.endswith(".fasta")]
+
+
+class ScatteredArchiveError(Exception):
+    """Raised if the members of a job folder are not stored consecutively, so the archive cannot be streamed."""
+
+
+def read_job_folders(tf: tarfile.TarFile) -> Iterator[ArchiveFolder]:
+    """
+    Reads all relevant members of a tar archive in a single forward pass and groups them by job folder.
+    Relies on the contents of each job folder being stored consecutively, as done by `tar`,
+    and raises a `ScatteredArchiveError` once a job folder reappears after another one.
+    """
+
+    folder_name = None
+    finished = set()
+    files = {}
+    for member in tf:
+        parts = PurePosixPath(member.name).parts
+        # Only files directly within a job folder are considered (same as for an extracted archive)
+        if not member.isfile() or len(parts) != 2:
+            continue
+        if not parts[1].endswith(tuple(f".{extension}" for extension in EXTENSIONS)):
+            continue
+
+        if parts[0] != folder_name:
+            if parts[0] in finished:
+                raise ScatteredArchiveError(f"Members of {parts[0]} are not stored consecutively.")
+            if files:
+                yield ArchiveFolder(folder_name, files)
+            finished.add(folder_name)
+            folder_name = parts[0]
+            files = {}
+        files[parts[1]] = tf.extractfile(member).read()
+
+    if files:
+        yield ArchiveFolder(folder_name, files)
+
+
+def find_proteins(folder) -> List[str]:
+    """Identifies the proteins of a job folder based on the present .fasta files."""
+
+    if isinstance(folder, ArchiveFolder):
+        return folder.proteins()
+    # (required existence of a .fasta for each protein)
+    return [p.stem for p in folder.glob("*.fasta")]
+
+
+def parse_folders(folders: List) -> Tuple[List[Tuple], MessageCollector, Profile]:
+    """
+    Parses all proteins of a batch of job folders.
+    Returns the parsed proteins, all collected messages and the timings of the parsers.
+    """
+
+    messages = MessageCollector()
+    with recording(Profile()) as profile:
+        proteins = [
+            parse_protein(folder, protein, messages)
+            for folder in folders
+            for protein in find_proteins(folder)
+        ]
+    return proteins, messages, profile
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[List]:
+    """Splits an iterable into lists of (at most) `size` elements."""
+
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def imap_bounded(pool: Pool, f: Callable, iterable: Iterable, workers: int) -> Iterator:
+    """
+    Like `Pool.imap`, but only ever submits a few tasks per worker ahead of the consumer.
+    This keeps the memory of lazily read inputs (e.g. archive members) bounded.
+    """
+
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(f, (item,)))
+        if len(pending) >= 2 * workers:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def parse_parallel(folders: Iterable, import_job_pk: int):
+    """
+    Parses batches of job folders in a pool of worker processes and returns a generator.
+    Proteins are returned in the order of the given folders, independent of the number of workers.
+    """
+
+    workers = settings.PPPRINT_PARSE_WORKERS
+    batches = batched(folders, settings.PPPRINT_PARSE_BATCH_SIZE)
+
+    def collect(results):
+        collector = get_collector(import_job_pk)
+        for proteins, messages, profile in results:
+            # Only the parent process keeps the messages, they are written to the database after the import
+            collector.update(messages)
+            merge(profile)
+            yield from proteins
+
+    if workers <= 1:
+        yield from collect(map(parse_folders, batches))
+    else:
+        # Celery workers are daemonic, so the pool has to come from billiard instead of multiprocessing
+        pool = Pool(processes=workers)
+        try:
+            yield from collect(imap_bounded(pool, parse_folders, batches, workers))
+        finally:
+            # Let the workers finish their batches and exit on their own instead of terminating them,
+            # also if reading the folders fails (see `ScatteredArchiveError`), as busy workers may deadlock otherwise
+            pool.close()
+            pool.join()
+
+
+def parse_archive(archive: Path, import_job_pk: int):
+    """Parses sequence, tmseg, prona, reprof and mdisorder straight from a tar archive and returns a generator."""
+
+    try:
+        with tarfile.open(archive, "r|*") as tf:
+            yield from parse_parallel(read_job_folders(tf), import_job_pk)
+    except tarfile.ReadError:
+        message = "Failed to read proteome file. No ImportJob was created!"
+        raise LoggedException(message)
+
+
 def parse(base_path: Path, import_job_pk: int):
     """Parses sequence, tmseg, prona, reprof and mdisorder and returns a generator."""
 
-    for p in (p for p in base_path.iterdir() if p.is_dir()):
-        # Identify the proteins based on the present .fasta files
-        # (required existence of a .fasta for each protein)
-        fasta_files = list(p.glob("*.fasta"))
-        for protein in (p.stem for p in fasta_files):
-            yield parse_protein(p, protein, import_job_pk)
-
-
-def write_json(base_path: Path, out_file: Path, import_job_pk: int):
-    """Writes a JSON file for a given proteome."""
-
-    json.JSONEncoder(ensure_ascii=False, check_circular=False)
-    with open(out_file, "w") as f:
-        # We have to store everything in a list to make the json encoder happy :(
-        # (Actually we don't have to, but it's required on loading anyways)
-        data = [
-            {
-                "sequence": sequence,
-                "tmseg": tmseg,
-                "prona": prona,
-                "mdisorder": mdisorder,
-                "reprof": reprof,
-            }
-            for sequence, tmseg, prona, mdisorder, reprof in parse(base_path, import_job_pk)
-        ]
+    folders = (p for p in base_path.iterdir() if p.is_dir())
+    yield from parse_parallel(folders, import_job_pk)
 
-        if len(data) == 0:
-            m = "Could not find any proteins. Make sure to check required data structure within the archive."
-            raise LoggedException(m)
-        else:
-            for chunk in json.JSONEncoder().iterencode(data):
-                f.write(chunk)
 
+def parse_proteome(base_path: Path, import_job_pk: int):
+    """Parses a proteome, either from extracted job folders or from the archive itself."""
+
+    if base_path.is_dir():
+        return parse(base_path, import_job_pk)
+    return parse_archive(base_path, import_job_pk)
+
+
+def write_data(base_path: Path, out_file: Path, import_job_pk: int):
+    """
+    Writes the columnar regions and sequences tables (.npz) for a given proteome.
+    Features and descriptions are stored as integer codes into the `features` and `descriptions` arrays.
+    """
+
+    # Regions table
+    proteins, features, begins, ends, descriptions = [], [], [], [], []
+    description_codes = {}
+    # Sequences table
+    sequences, lengths = [], []
+
+    for i, (sequence, tmseg, prona, mdisorder, reprof) in enumerate(
+        parse_proteome(base_path, import_job_pk)
+    ):
+        sequences.append(sequence.encode())
+        lengths.append(len(sequence))
+
+        regions = {"tmseg": tmseg, "prona": prona, "mdisorder": mdisorder, "reprof": reprof}
+        for feature_code, feature in enumerate(FEATURES):
+            for region in regions[feature]:
+                proteins.append(i)
+                features.append(feature_code)
+                begins.append(region["begin"])
+                ends.append(region["end"])
+                descriptions.append(
+                    description_codes.setdefault(region["description"], len(description_codes))
+                )
+
+    if len(sequences) == 0:
+        m = "Could not find any proteins. Make sure to check required data structure within the archive."
+        raise LoggedException(m)
+
+    with open(out_file, "wb") as f:
+        np.savez(
+            f,
+            protein=np.array(proteins, dtype=np.int32),
+            feature=np.array(features, dtype=np.int8),
+            begin=np.array(begins, dtype=np.int32),
+            end=np.array(ends, dtype=np.int32),
+            description=np.array(descriptions, dtype=np.int16),
+            features=np.array(FEATURES),
+            descriptions=np.array(list(description_codes), dtype=str),
+            sequences=np.frombuffer(b"".join(sequences), dtype=np.uint8),
+            sequence_offsets=np.cumsum([0] + [len(s) for s in sequences], dtype=np.int64),
+            protein_length=np.array(lengths, dtype=np.int32),
+        )
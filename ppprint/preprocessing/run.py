@@ -2,24 +2,31 @@
 Runs preprocessing of raw upload data.
 """
 
-import os
 import pickle
 import tarfile
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Mapping
 
 import pandas as pd
 
 from django.conf import settings
 
 from ppprint.models import ImportJob
-from ppprint.preprocessing.parse import write_json
+from ppprint.preprocessing.messages import get_collector
+from ppprint.preprocessing.parse import ScatteredArchiveError, write_data
+from ppprint.preprocessing.store import ResultStore, has_results, write_results
 from ppprint.preprocessing.utils import LoggedException
-from ppprint.preprocessing.extract import extract_pbased, extract_rbased, read_json
+from ppprint.profiling import measure
+from ppprint.preprocessing.extract import (
+    compact_dtypes,
+    extract_all,
+    read_source,
+    upgrade_rbased,
+)
 
 
-def extract_data(base_folder: Path, data_folder: Path):
-    """Unpacks .tar and .tar.gz files into job folders."""
+def find_archive(base_folder: Path) -> Path:
+    """Returns the uploaded archive of an ImportJob folder."""
     archive = next(base_folder.iterdir())
 
     # If .pickle already present, but need new DataFrames
@@ -27,6 +34,13 @@ def extract_data(base_folder: Path, data_folder: Path):
         if not item.is_dir() and tarfile.is_tarfile(item):
             archive = item
 
+    return archive
+
+
+def extract_data(base_folder: Path, data_folder: Path):
+    """Unpacks .tar and .tar.gz files into job folders."""
+    archive = find_archive(base_folder)
+
     try:
         with tarfile.open(archive, "r") as tf:
             tf.extractall(data_folder)
@@ -35,17 +49,59 @@ def extract_data(base_folder: Path, data_folder: Path):
         raise LoggedException(message)
 
 
-def run_extract(import_job_pk: int):
-    """Extracts uploaded archives and preprocesses data into JSON format for a given proteome."""
+def run_unpack(import_job_pk: int):
+    """Unpacks the uploaded archive into job folders, unless its members are parsed straight from the archive."""
+
+    if not settings.PPPRINT_STREAMING_IMPORT:
+        base_folder = get_base_folder(import_job_pk)
+        extract_data(base_folder, base_folder / "data")
+
+
+def run_parse(import_job_pk: int):
+    """Parses the job folders (or archive members) of an upload into the intermediate columnar format."""
 
     base_folder = get_base_folder(import_job_pk)
-    data_folder = base_folder / "data"
-    json_path = base_folder / "data.json"
+    if settings.PPPRINT_STREAMING_IMPORT:
+        # Parse members straight from the archive, without writing job folders to disk
+        try:
+            write_data(find_archive(base_folder), get_data_path(import_job_pk), import_job_pk)
+            return
+        except ScatteredArchiveError:
+            # Job folders are only complete once the whole archive is read, so it is unpacked instead
+            get_collector(import_job_pk).clear()
+            extract_data(base_folder, base_folder / "data")
+    write_data(base_folder / "data", get_data_path(import_job_pk), import_job_pk)
+
 
-    extract_data(base_folder, data_folder)
-    write_json(data_folder, json_path, import_job_pk)
+def run_frames(import_job_pk: int):
+    """Extracts the result dataframes from the intermediate format and stores them."""
 
-    return json_path
+    store(run_info(get_data_path(import_job_pk)), get_result_folder(import_job_pk))
+
+
+# Stages of an import in order. Each stage leaves a checkpoint once completed,
+# so that an interrupted import resumes with the first stage not completed before
+IMPORT_STAGES = {
+    "unpack": run_unpack,
+    "parse": run_parse,
+    "extract": run_frames,
+}
+
+
+def get_checkpoint(import_job_pk: int, stage: str) -> Path:
+    return get_base_folder(import_job_pk) / f".{stage}.done"
+
+
+def run_stage(import_job_pk: int, stage: str):
+    """Runs a stage of an import, unless it was completed before."""
+
+    checkpoint = get_checkpoint(import_job_pk, stage)
+    if checkpoint.exists():
+        return
+    # Files of an interrupted run of the stage are overwritten
+    with measure(stage):
+        IMPORT_STAGES[stage](import_job_pk)
+    checkpoint.touch()
 
 
 def get_base_folder(import_job_pk: int):
@@ -58,31 +114,43 @@ def get_base_folder(import_job_pk: int):
     return base_folder
 
 
-def run_info(json_path: Path) -> Dict[str, pd.DataFrame]:
-    """Preprocesses data from JSON into info-containing data frames for a given proteome."""
+def run_info(data_path: Path) -> Dict[str, pd.DataFrame]:
+    """Preprocesses data from the intermediate format (.npz or JSON) into info-containing data frames for a given proteome."""
+
+    df_source, df_seq = read_source(data_path)
+
+    # Protein-level and region-level extraction for each feature, for the given proteome
+    return extract_all(df_source, df_seq, workers=settings.PPPRINT_EXTRACT_WORKERS)
+
 
-    df_source, df_seq = read_json(json_path)
+def get_data_path(import_job_pk: int) -> Path:
+    return get_base_folder(import_job_pk) / "data.npz"
 
-    results = {}
-    # Will contain both pbased and rbased results for each feature, for the given proteome
 
-    # Protein-level extraction
-    results.update(extract_pbased(df_source, df_seq))
+def get_result_folder(import_job_pk: int) -> Path:
+    return get_base_folder(import_job_pk) / "results"
 
-    # Region-level extraction
-    results.update(extract_rbased(df_source, df_seq))
 
-    return results
+def store(results: Dict[str, pd.DataFrame], folder: Path):
+    write_results(results, folder)
 
 
-def store(results: Dict[str, pd.DataFrame], path: Path):
-    with open(path, "wb") as f:
-        pickle.dump(results, f)
+def load(import_job_pk: int) -> Mapping[str, pd.DataFrame]:
+    """Opens the results of an import, whose dataframes are loaded lazily."""
 
+    folder = get_result_folder(import_job_pk)
+    if has_results(folder):
+        return ResultStore(folder)
 
-def load(path: Path) -> Dict[str, pd.DataFrame]:
-    with open(path, "rb") as f:
-        return pickle.load(f)
+    # Old imports pickled all results into a single file, still storing regions as tuples, with wide dtypes
+    with open(get_base_folder(import_job_pk) / "results.pickle", "rb") as f:
+        results = pickle.load(f)
+    return {
+        source_type: compact_dtypes(
+            upgrade_rbased(df) if source_type.endswith("rbased") else df
+        )
+        for source_type, df in results.items()
+    }
 
 
 # if __name__ == "__main__":
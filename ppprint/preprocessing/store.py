@@ -0,0 +1,154 @@
+"""
+Columnar store of import results: one file per result dataframe, described by a small JSON manifest.
+The columns of a dataframe are laid out back to back as raw arrays, so that they can be memory-mapped
+and the dataframes loaded lazily without copying.
+"""
+
+import json
+import os
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Dict, Iterator
+
+import numpy as np
+import pandas as pd
+
+# Bump whenever the layout of the stored files changes
+STORE_VERSION = 1
+
+MANIFEST = "manifest.json"
+
+# Columns start at multiples of this many bytes, so that every memory-mapped column is aligned
+ALIGNMENT = 64
+
+
+def frame_file(source_type: str) -> str:
+    """Returns the file name of a result dataframe, e.g. "tmseg_pbased.bin" for "tmseg pbased"."""
+
+    return f"{source_type.replace(' ', '_')}.bin"
+
+
+def replace_file(path: Path, write):
+    """Writes a file via `write(f)` to a new file and moves it to `path` atomically."""
+
+    # Write to a new file, as `path` may be a hard link into the import cache
+    tmp_path = path.with_name(f".{path.name}")
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def column_arrays(values: pd.Series):
+    """Returns the array to store for a column, together with its categories (or None if not categorical)."""
+
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(), values.cat.categories.tolist()
+    if values.dtype == object:
+        return column_arrays(values.astype("category"))
+    if values.dtype.kind not in "biuf":
+        raise ValueError(f"Cannot store column {values.name!r} of dtype {values.dtype}")
+    return values.to_numpy(), None
+
+
+def write_frame(df: pd.DataFrame, path: Path) -> Dict:
+    """Writes the index (unless a RangeIndex) and the columns of a dataframe to a single file. Returns its manifest entry."""
+
+    columns = list(df.items())
+    if not isinstance(df.index, pd.RangeIndex):
+        columns.insert(0, (df.index.name, df.index.to_series()))
+
+    entries = []
+
+    def write(f):
+        offset = 0
+        for name, values in columns:
+            array, categories = column_arrays(values)
+            padding = -offset % ALIGNMENT
+            data = np.ascontiguousarray(array).tobytes()
+            f.write(b"\0" * padding + data)
+            entries.append(
+                {
+                    "name": name,
+                    "dtype": array.dtype.str,
+                    "offset": offset + padding,
+                    "categories": categories,
+                }
+            )
+            offset += padding + len(data)
+
+    replace_file(path, write)
+    return {
+        "file": path.name,
+        "rows": len(df),
+        "index": entries.pop(0) if len(entries) > len(df.columns) else None,
+        "columns": entries,
+    }
+
+
+def write_results(results: Dict[str, pd.DataFrame], folder: Path):
+    """Stores all result dataframes of an import in `folder`. The manifest is written last."""
+
+    folder.mkdir(parents=True, exist_ok=True)
+    manifest = {
+        "version": STORE_VERSION,
+        "frames": {
+            source_type: write_frame(df, folder / frame_file(source_type))
+            for source_type, df in results.items()
+        },
+    }
+    replace_file(folder / MANIFEST, lambda f: f.write(json.dumps(manifest, indent=1).encode()))
+
+
+def read_manifest(folder: Path) -> Dict:
+    with open(folder / MANIFEST, "r") as f:
+        manifest = json.load(f)
+    if manifest["version"] != STORE_VERSION:
+        raise ValueError(f"Unsupported result store version {manifest['version']} in {folder}")
+    return manifest
+
+
+def read_column(path: Path, rows: int, entry: Dict):
+    """Memory-maps a single stored column."""
+
+    if rows:
+        values = np.memmap(path, dtype=entry["dtype"], mode="r", offset=entry["offset"], shape=(rows,))
+    else:
+        values = np.empty(0, dtype=entry["dtype"])
+    if entry["categories"] is not None:
+        return pd.Categorical.from_codes(values, entry["categories"])
+    return values
+
+
+def read_frame(folder: Path, entry: Dict) -> pd.DataFrame:
+    """Loads a stored dataframe, with its columns memory-mapped. The resulting dataframe is read-only."""
+
+    path = folder / entry["file"]
+    columns = {column["name"]: read_column(path, entry["rows"], column) for column in entry["columns"]}
+    index = None
+    if entry["index"] is not None:
+        index = pd.Index(read_column(path, entry["rows"], entry["index"]), name=entry["index"]["name"])
+    return pd.DataFrame(columns, index=index, copy=False)
+
+
+class ResultStore(Mapping):
+    """Read-only mapping of source types to result dataframes, each loaded from the store on first access."""
+
+    def __init__(self, folder: Path):
+        self.folder = folder
+        self.frames = read_manifest(folder)["frames"]
+        self.loaded: Dict[str, pd.DataFrame] = {}
+
+    def __getitem__(self, source_type: str) -> pd.DataFrame:
+        if source_type not in self.loaded:
+            self.loaded[source_type] = read_frame(self.folder, self.frames[source_type])
+        return self.loaded[source_type]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.frames)
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+
+def has_results(folder: Path) -> bool:
+    return (folder / MANIFEST).exists()
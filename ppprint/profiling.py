@@ -0,0 +1,205 @@
+"""
+Records wall time, CPU time and peak memory (RSS) of the stages of import and visualization jobs.
+Measurements are collected in memory while a job runs and written to the database at once,
+from where they are shown in the admin and exported as Prometheus metrics.
+"""
+
+import itertools
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Type
+
+from ppprint.models import ImportJob, Job, Measurement, VisualizationJob
+
+# Guards the profiles against measurements of concurrent threads, e.g. of the extractions of an import
+lock = threading.Lock()
+
+
+class Profile:
+    """Accumulates the measurements of a job by stage, e.g. over all calls of a parser."""
+
+    def __init__(self):
+        # Maps a stage to the number of calls, wall time, CPU time and the peak RSS
+        self.stages: Dict[str, List] = {}
+
+    def add(self, stage: str, wall_time: float, cpu_time: float, peak_rss: int, calls: int = 1):
+        with lock:
+            entry = self.stages.setdefault(stage, [0, 0.0, 0.0, 0])
+            entry[0] += calls
+            entry[1] += wall_time
+            entry[2] += cpu_time
+            entry[3] = max(entry[3], peak_rss)
+
+    def update(self, other: "Profile"):
+        """Merges the measurements of another profile (e.g. of a worker process) into this one."""
+
+        for stage, (calls, wall_time, cpu_time, peak_rss) in other.stages.items():
+            self.add(stage, wall_time, cpu_time, peak_rss, calls)
+
+
+# Profile of the job running in this process, measurements without a running job are dropped
+current: Optional[Profile] = None
+
+
+# Resets the peak RSS of this process on Linux, see proc(5)
+CLEAR_REFS = Path("/proc/self/clear_refs")
+STATUS = Path("/proc/self/status")
+
+# Peak RSS observed so far by every running measurement, raised whenever another measurement resets it
+running: Dict[int, int] = {}
+keys = itertools.count()
+
+
+def peak_rss() -> int:
+    """Returns the peak resident set size of this process in bytes, since it was last reset by `reset_peak_rss`."""
+
+    try:
+        for line in STATUS.read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # Lifetime peak of the process where it cannot be reset
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes, except on macOS
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def reset_peak_rss():
+    """
+    Resets the peak RSS of this process to its current RSS, if supported, after handing the peak so far
+    to the running measurements, which includes those of concurrent threads and enclosing stages.
+    """
+
+    with lock:
+        peak = peak_rss()
+        for key in running:
+            running[key] = max(running[key], peak)
+        try:
+            CLEAR_REFS.write_text("5")
+        except OSError:
+            pass
+
+
+def cpu_time(per_thread: bool = False) -> float:
+    """
+    Returns the CPU time of this process, including its finished worker processes,
+    or that of the calling thread only, for stages running concurrently in a thread pool.
+    """
+
+    if per_thread:
+        return time.thread_time()
+    times = os.times()
+    return time.process_time() + times.children_user + times.children_system
+
+
+@contextmanager
+def measure(stage: str, per_thread: bool = False) -> Iterator[None]:
+    """
+    Measures a stage of the running job, adding up repeated measurements of the same stage.
+    CPU time is that of the whole process, unless `per_thread` is set for stages running in a thread pool,
+    which would count the CPU time of concurrent stages otherwise.
+    Peak RSS is the highest RSS of the whole process (including concurrent threads) while the stage ran.
+    It is reset at the start of each stage on Linux, elsewhere it is the peak over the lifetime of the process.
+    """
+
+    reset_peak_rss()
+    key = next(keys)
+    with lock:
+        running[key] = 0
+    wall_start, cpu_start = time.perf_counter(), cpu_time(per_thread)
+    try:
+        yield
+    finally:
+        wall_time, used_cpu = time.perf_counter() - wall_start, cpu_time(per_thread) - cpu_start
+        with lock:
+            peak = max(running.pop(key), peak_rss())
+        if current is not None:
+            current.add(stage, wall_time, used_cpu, peak)
+
+
+@contextmanager
+def recording(profile: Profile) -> Iterator[Profile]:
+    """Records all measurements within the block in `profile`, e.g. to send them from a worker process."""
+
+    global current
+    previous, current = current, profile
+    try:
+        yield profile
+    finally:
+        current = previous
+
+
+def merge(profile: Profile):
+    """Adds the measurements of a worker to the running job."""
+
+    if current is not None:
+        current.update(profile)
+
+
+@contextmanager
+def profiling(cls: Type[Job], pk: int) -> Iterator[Profile]:
+    """Records the measurements of a job within the block and stores them once it is left, also if it fails."""
+
+    with recording(Profile()) as profile:
+        try:
+            yield profile
+        finally:
+            store_profile(cls, pk, profile)
+
+
+def store_profile(cls: Type[Job], pk: int, profile: Profile):
+    """Writes the measurements of a job to the database with a single bulk insert."""
+
+    if profile.stages:
+        measurements = Measurement.objects.bulk_create(
+            Measurement(
+                stage=stage,
+                calls=calls,
+                wall_time=wall_time,
+                cpu_time=cpu_time,
+                peak_rss=peak_rss,
+            )
+            for stage, (calls, wall_time, cpu_time, peak_rss) in profile.stages.items()
+        )
+        cls.objects.get(pk=pk).measurements.add(*measurements)
+
+
+def job_profile(job: Job) -> Profile:
+    """Returns the measurements of a job, merging those stored by different tasks of the job by stage."""
+
+    profile = Profile()
+    for m in job.measurements.all():
+        profile.add(m.stage, m.wall_time, m.cpu_time, m.peak_rss, m.calls)
+    return profile
+
+
+# Name, position in the measurements of a stage and description of every exported metric
+METRICS = [
+    ("calls", 0, "Number of runs of a stage of a job, e.g. of a parser for all files"),
+    ("wall_seconds", 1, "Wall time of a stage of a job in seconds"),
+    ("cpu_seconds", 2, "CPU time of a stage of a job in seconds"),
+    ("peak_rss_bytes", 3, "Peak resident set size of the process while running a stage of a job in bytes"),
+]
+
+
+def prometheus_text(jobs: Iterable[Job]) -> str:
+    """Exports the measurements of the given jobs in the Prometheus text format, labelled by job and stage."""
+
+    samples = []
+    for job in jobs:
+        kind = {ImportJob: "import", VisualizationJob: "visualization"}[type(job)]
+        for stage, values in job_profile(job).stages.items():
+            samples.append((f'job="{kind}",pk="{job.pk}",stage="{stage}"', values))
+
+    lines = []
+    for name, position, description in METRICS:
+        lines.append(f"# HELP ppprint_stage_{name} {description}")
+        lines.append(f"# TYPE ppprint_stage_{name} gauge")
+        lines.extend(f"ppprint_stage_{name}{{{labels}}} {values[position]}" for labels, values in samples)
+    return "\n".join(lines) + "\n"
@@ -142,3 +142,42 @@ CELERY_TASK_SEND_SENT_EVENT = True
 # Bootstrap
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
+
+# ppprint
+# Parse uploaded archives member by member instead of extracting them into job folders first
+PPPRINT_STREAMING_IMPORT = True
+# Number of worker processes parsing job folders during an import (1 parses within the task itself)
+PPPRINT_PARSE_WORKERS = 4
+# Number of job folders sent to a parse worker at once
+PPPRINT_PARSE_BATCH_SIZE = 32
+# Number of example proteins stored with an aggregated import warning
+PPPRINT_MESSAGE_EXAMPLES = 5
+# Reuse the results of previous uploads of an identical archive
+PPPRINT_IMPORT_CACHE = True
+# Number of worker processes rendering the plots of a comparison (1 renders within the task itself)
+PPPRINT_PLOT_WORKERS = 4
+# Number of threads running the protein- and region-based extractions of an import concurrently
+PPPRINT_EXTRACT_WORKERS = 4
+# Maximum number of proteomes compared by a single visualization job
+PPPRINT_MAX_PROTEOMES = 200
+# Up to this many proteomes, comparisons show every pair in detail, beyond only (clustered) summary matrices
+PPPRINT_PAIRWISE_PROTEOMES = 4
+# Cache per-proteome statistics of the plots (bins, error bars, means, ...) for later comparisons
+PPPRINT_STATISTICS_CACHE = True
+# Link the images of earlier comparisons of the same proteomes and colors instead of rendering them again
+PPPRINT_RENDER_CACHE = True
+# Disk budget of the cached images in bytes, least recently used images are evicted beyond
+PPPRINT_RENDER_CACHE_SIZE = 1024**3
+# Render the plots of a comparison per view, finishing the job as soon as the first view is rendered
+PPPRINT_LAZY_RENDERING = True
+# Render the other views in the background after the first one (else only when they are requested)
+PPPRINT_BACKGROUND_RENDERING = True
+# Render every plot of a comparison in its own Celery task, spreading the plots across all workers
+PPPRINT_PLOT_TASKS = True
+# Celery queues of the import stages ("unpack", "parse", "extract"), e.g. to run them on I/O- or CPU-heavy
+# workers. Stages without a queue run within the task of the previous stage
+PPPRINT_IMPORT_QUEUES = {}
+# Export the measurements of the most recent jobs as Prometheus metrics at /metrics, which is not authenticated
+PPPRINT_METRICS = False
+# Number of most recent import and visualization jobs (each) exported at /metrics
+PPPRINT_METRICS_JOBS = 100
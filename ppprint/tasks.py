@@ -1,19 +1,44 @@
+import logging
+import time
 from pathlib import Path
-from typing import Type
+from typing import Dict, List, Optional, Type
 
+from celery import chord
 from django.conf import settings
 
 from ppprint.celery import app
 from ppprint.models import ImportJob, Job, StatusChoices, VisualizationJob
+from ppprint.preprocessing.cache import cache_results, hash_file, restore_results
+from ppprint.preprocessing.messages import collecting
+from ppprint.profiling import profiling
 from ppprint.preprocessing.run import (
+    IMPORT_STAGES,
+    find_archive,
     get_base_folder,
+    get_checkpoint,
+    get_result_folder,
     load,
-    run_extract,
-    run_info,
-    store,
+    run_stage,
     LoggedException,
 )
-from ppprint.visualization.run import run
+from ppprint.visualization import PLOTS, VIEWS
+from ppprint.visualization.render_cache import evict
+from ppprint.visualization.run import (
+    PLOTS_BY_NAME,
+    claim_view,
+    finish_view,
+    get_mapping,
+    get_visualization_folder,
+    pending_plots,
+    render_job_plot,
+    run,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Returned by tasks whose job is finished by the tasks they started
+DEFERRED = "deferred"
 
 
 def watchdog(cls: Type[Job]):
@@ -22,7 +47,8 @@ def watchdog(cls: Type[Job]):
             cls.objects.filter(pk=pk).update(status=StatusChoices.RUNNING)
 
             try:
-                result = f(self, pk, *args, **kwargs)
+                with profiling(cls, pk):
+                    result = f(self, pk, *args, **kwargs)
             except LoggedException as logexc:
                 job = cls.objects.get(pk=pk)
                 job.status = StatusChoices.FAILURE
@@ -34,7 +60,9 @@ def watchdog(cls: Type[Job]):
                 cls.objects.filter(pk=pk).update(status=StatusChoices.FAILURE)
                 raise exc
 
-            cls.objects.filter(pk=pk).update(status=StatusChoices.SUCCESS)
+            # Tasks that fan out leave the status to the task finishing them
+            if result != DEFERRED:
+                cls.objects.filter(pk=pk).update(status=StatusChoices.SUCCESS)
             return result
 
         return inner
@@ -45,20 +73,221 @@ def watchdog(cls: Type[Job]):
 @app.task(bind=True, name="run_import_job")
 @watchdog(ImportJob)
 def run_import_job(self, import_job_pk: int):
-    json_path = run_extract(import_job_pk)
-    results = run_info(json_path)
-    result_file = get_base_folder(import_job_pk) / "results.pickle"
-    store(results, result_file)
+    if settings.PPPRINT_IMPORT_CACHE:
+        digest = get_digest(import_job_pk)
+        if restore_results(digest, get_result_folder(import_job_pk)):
+            copy_messages(import_job_pk, digest)
+            return
+
+    return continue_import(import_job_pk, list(IMPORT_STAGES))
+
+
+@app.task(bind=True, name="run_import_stage")
+@watchdog(ImportJob)
+def run_import_stage(self, import_job_pk: int, stage: str):
+    """Runs a stage of an import sent to its own queue, then continues the import with the following stages."""
+
+    stages = list(IMPORT_STAGES)
+    complete_stage(import_job_pk, stage)
+    return continue_import(import_job_pk, stages[stages.index(stage) + 1 :])
+
+
+def continue_import(import_job_pk: int, stages: List[str]):
+    """
+    Runs the given stages of an import in order, skipping those completed before.
+    The first stage with a queue of its own is sent there, and the import is continued by its task.
+    """
+
+    for stage in stages:
+        if get_checkpoint(import_job_pk, stage).exists():
+            continue
+        queue = settings.PPPRINT_IMPORT_QUEUES.get(stage)
+        if queue:
+            run_import_stage.apply_async((import_job_pk, stage), queue=queue)
+            return DEFERRED
+        complete_stage(import_job_pk, stage)
+
+    if settings.PPPRINT_IMPORT_CACHE:
+        cache_results(get_digest(import_job_pk), get_result_folder(import_job_pk))
+
+
+def complete_stage(import_job_pk: int, stage: str):
+    # Warnings are collected during each stage and stored at once, also if the stage fails
+    with collecting(import_job_pk):
+        run_stage(import_job_pk, stage)
+
+
+def get_digest(import_job_pk: int) -> str:
+    """Returns the SHA-256 of the uploaded archive, hashing it if not done during the upload."""
+
+    ij = ImportJob.objects.get(pk=import_job_pk)
+    if not ij.sha256:
+        ij.sha256 = hash_file(find_archive(get_base_folder(import_job_pk)))
+        ij.save(update_fields=["sha256"])
+    return ij.sha256
+
+
+def copy_messages(import_job_pk: int, digest: str):
+    """Adds the warnings of a previous import of an identical archive to an ImportJob."""
+
+    previous = (
+        ImportJob.objects.filter(sha256=digest, status=StatusChoices.SUCCESS)
+        .exclude(pk=import_job_pk)
+        .last()
+    )
+    if previous is not None:
+        ImportJob.objects.get(pk=import_job_pk).messages.add(*previous.messages.all())
 
 
 @app.task(bind=True, name="run_visualization_job")
 @watchdog(VisualizationJob)
-def run_visualization_job(self, visualization_job_pk: int):
+def run_visualization_job(self, visualization_job_pk: int, view: str = "overview"):
+    if settings.PPPRINT_LAZY_RENDERING:
+        # The job is finished as soon as the requested view is rendered, the others follow later
+        plots = VIEWS[view]
+        if not claim_view(visualization_job_pk, view):
+            # Rendered already, e.g. by a redelivered task, or being rendered for a request, which waits for it
+            if settings.PPPRINT_BACKGROUND_RENDERING:
+                render_views.delay(visualization_job_pk)
+            return
+    else:
+        plots, view = PLOTS, None
+
+    if settings.PPPRINT_PLOT_TASKS:
+        render_deferred(visualization_job_pk, plots, view, finish_job=True)
+        return DEFERRED
+
+    try:
+        run(visualization_job_pk, load_sources(visualization_job_pk), plots)
+    finally:
+        if view is not None:
+            finish_view(visualization_job_pk, view)
+
+    if view is not None and settings.PPPRINT_BACKGROUND_RENDERING:
+        render_views.delay(visualization_job_pk)
+
+
+@app.task(bind=True, name="render_view")
+def render_view(self, visualization_job_pk: int, view: str):
+    """Renders a view of a finished comparison, claimed by the request that found it missing."""
+
+    if settings.PPPRINT_PLOT_TASKS:
+        render_deferred(visualization_job_pk, VIEWS[view], view)
+        return
+
+    try:
+        render_plots(visualization_job_pk, load_sources(visualization_job_pk), VIEWS[view])
+    finally:
+        finish_view(visualization_job_pk, view)
+
+
+@app.task(bind=True, name="render_views")
+def render_views(self, visualization_job_pk: int):
+    """Renders all views of a finished comparison that are not rendered yet, one after another."""
+
+    data = None
+    for view, plots in VIEWS.items():
+        # Views may be claimed meanwhile by requests for them
+        if not claim_view(visualization_job_pk, view):
+            continue
+        if settings.PPPRINT_PLOT_TASKS:
+            render_deferred(visualization_job_pk, plots, view)
+            continue
+        try:
+            data = data or load_sources(visualization_job_pk)
+            render_plots(visualization_job_pk, data, plots)
+        finally:
+            finish_view(visualization_job_pk, view)
+
+
+def render_deferred(visualization_job_pk: int, plots, view: Optional[str] = None, finish_job: bool = False):
+    """
+    Renders plots of a comparison by one task per plot, spread across the workers.
+    Once all of them are done, `finish_plots` finishes the view (and the job itself if requested).
+    If any of the tasks fails, e.g. due to a lost worker, `fail_plots` finishes them instead.
+    """
+
+    try:
+        vj = VisualizationJob.objects.get(pk=visualization_job_pk)
+        missing = pending_plots(plots, get_mapping(vj), get_visualization_folder(visualization_job_pk))
+        finish = finish_plots.s(visualization_job_pk, len(plots), view, finish_job)
+        if missing:
+            finish.on_error(fail_plots.s(visualization_job_pk, view, finish_job))
+            chord(render_plot.s(visualization_job_pk, plot_cls.__name__) for plot_cls in missing)(finish)
+            return
+    except Exception:
+        # The job itself is failed by watchdog
+        if view is not None:
+            finish_view(visualization_job_pk, view)
+        raise
+    finish_plots([], visualization_job_pk, len(plots), view, finish_job)
+
+
+@app.task(bind=True, name="render_plot")
+def render_plot(self, visualization_job_pk: int, plot_name: str):
+    """Renders a single plot of a comparison. Returns the plot, a message if it failed and its rendering time."""
+
+    start = time.perf_counter()
+    with profiling(VisualizationJob, visualization_job_pk):
+        message = render_job_plot(
+            visualization_job_pk, load_sources(visualization_job_pk), PLOTS_BY_NAME[plot_name]
+        )
+    return {"plot": plot_name, "message": message, "seconds": time.perf_counter() - start}
+
+
+@app.task(bind=True, name="fail_plots")
+def fail_plots(self, request, exc, traceback, visualization_job_pk: int, view: Optional[str], finish_job: bool):
+    """Error callback of the plots rendered by `render_deferred`, finishing the view and failing the job if requested."""
+
+    logger.error(f"Failed to render plots of visualization job {visualization_job_pk}: {exc!r}")
+    if view is not None:
+        finish_view(visualization_job_pk, view)
+    if finish_job:
+        VisualizationJob.objects.get(pk=visualization_job_pk).add_message("Could not create plots.")
+        VisualizationJob.objects.filter(pk=visualization_job_pk).update(status=StatusChoices.FAILURE)
+
+
+@app.task(bind=True, name="finish_plots")
+def finish_plots(
+    self, results: List[Dict], visualization_job_pk: int, total: int, view: Optional[str], finish_job: bool
+):
+    """Adds the messages of failed plots to the comparison and finishes the rendered view, and the job if requested."""
+
+    for result in results:
+        logger.info(
+            f"Rendered {result['plot']} of visualization job {visualization_job_pk} in {result['seconds']:.2f} s"
+        )
+    messages = [result["message"] for result in results if result["message"]]
+    vj = VisualizationJob.objects.get(pk=visualization_job_pk)
+    vj.add_messages(messages)
+    if settings.PPPRINT_RENDER_CACHE:
+        evict(settings.PPPRINT_RENDER_CACHE_SIZE)
+    if view is not None:
+        finish_view(visualization_job_pk, view)
+
+    if not finish_job:
+        return
+    if messages and len(messages) == total:
+        vj.add_message("Could not create any plots.")
+        VisualizationJob.objects.filter(pk=visualization_job_pk).update(status=StatusChoices.FAILURE)
+        return
+    VisualizationJob.objects.filter(pk=visualization_job_pk).update(status=StatusChoices.SUCCESS)
+    if view is not None and settings.PPPRINT_BACKGROUND_RENDERING:
+        render_views.delay(visualization_job_pk)
+
+
+def render_plots(visualization_job_pk: int, data, plots):
+    try:
+        run(visualization_job_pk, data, plots)
+    except LoggedException:
+        # The comparison itself already succeeded, messages of the failed plots are added to it
+        pass
+
+
+def load_sources(visualization_job_pk: int):
     job = VisualizationJob.objects.get(pk=visualization_job_pk)
 
     results = {}
     for source in job.sources.all():  # sources are ImportJobs
-        pickle_path = get_base_folder(source.pk) / "results.pickle"
-        results[source.pk] = load(pickle_path)
-
-    run(visualization_job_pk, results)
+        results[source.pk] = load(source.pk)
+    return results
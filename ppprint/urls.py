@@ -11,6 +11,7 @@ from ppprint.views import (
     detail_visualization_job,
     home,
     list_visualization_jobs,
+    metrics,
     import_job_status_page,
     direct_visualization,
     visualization_job_status_page,
@@ -30,6 +31,7 @@ urlpatterns = [
         visualization_job_status_page,
         name="visualization_job_status_page",
     ),
+    path("metrics", metrics, name="metrics"),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
 urlpatterns += staticfiles_urlpatterns()
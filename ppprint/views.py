@@ -1,14 +1,18 @@
+from itertools import chain
 from pathlib import Path
 
 from django.conf import settings
 from django.core.files.storage import default_storage
 from django.http import Http404, JsonResponse, HttpResponse
-from django.shortcuts import redirect, render, reverse
+from django.shortcuts import get_object_or_404, redirect, render, reverse
 
 from ppprint.forms import SelectionForm, UploadForm
 from ppprint.models import ImportJob, VisualizationJob, StatusChoices
-from ppprint.tasks import run_import_job, run_visualization_job
-from ppprint.visualization import ALL, MDISORDER, PRONA, TMSEG, REPROF, COMBINED
+from ppprint.preprocessing.cache import HashingFile
+from ppprint.profiling import prometheus_text
+from ppprint.tasks import render_view, run_import_job, run_visualization_job
+from ppprint.visualization import VIEWS
+from ppprint.visualization.run import claim_view, get_visualization_folder, view_rendered
 
 
 def home(request):
@@ -23,9 +27,11 @@ def create_import_job(request):
                 name=form.cleaned_data["name"], color=form.cleaned_data["color"]
             )
             filename = request.FILES["file"].name
-            default_storage.save(
-                f"import_job/{import_job.pk}/{filename}", request.FILES["file"]
-            )
+            # Hash the archive while saving it, to find results of identical uploads
+            upload = HashingFile(request.FILES["file"], filename)
+            default_storage.save(f"import_job/{import_job.pk}/{filename}", upload)
+            import_job.sha256 = upload.hexdigest()
+            import_job.save(update_fields=["sha256"])
             run_import_job.delay(import_job.pk)
             return redirect("import_job_status_page", pk=import_job.pk)
     else:
@@ -52,20 +58,24 @@ def list_visualization_jobs(request):
 
 def detail_visualization_job(request, pk):
     view = request.GET.get("view", "overview")
-    plots = {
-        "overview": ALL,
-        "mdisorder": MDISORDER,
-        "tmseg": TMSEG,
-        "prona": PRONA,
-        "reprof": REPROF,
-        "combined": COMBINED,
-    }
     try:
-        plot_classes = plots[view]
+        plot_classes = VIEWS[view]
     except KeyError:
         raise Http404("Feature view does not exist.")
+    # Looked up first, as the folder of the job is created by checking its views
+    vj = get_object_or_404(VisualizationJob, pk=pk)
+
+    rendering = settings.PPPRINT_LAZY_RENDERING and not view_rendered(pk, view)
+    # Render missing views of finished comparisons on their first request, once for all concurrent requests
+    if rendering and vj.status == StatusChoices.SUCCESS and claim_view(pk, view):
+        render_view.delay(pk, view)
+
+    # Plots are shown as they finish, until then the view refreshes itself
+    folder = get_visualization_folder(pk)
+    rendered = {cls.FILE_NAME for cls in plot_classes if (folder / f"{cls.FILE_NAME}.png").exists()}
+    if rendering and not rendered:
+        return render(request, "ppprint/vis_load.html")
 
-    vj = VisualizationJob.objects.get(pk=pk)
     base_path = settings.MEDIA_URL + f"visualization_job/{pk}/"
 
     # Use for general assembly of plots (without help texts)
@@ -84,7 +94,11 @@ def detail_visualization_job(request, pk):
     #     },
     # )
     mapping_dict = {
-        cls.FILE_NAME: (base_path + cls.FILE_NAME + ".png", cls.PLOT_NAME, i)
+        cls.FILE_NAME: (
+            base_path + cls.FILE_NAME + ".png" if not rendering or cls.FILE_NAME in rendered else "",
+            cls.PLOT_NAME,
+            i,
+        )
         for i, cls in enumerate(plot_classes)
     }
     return render(
@@ -95,6 +109,7 @@ def detail_visualization_job(request, pk):
             "view": view,
             "mapping": mapping_dict,
             "basepath": base_path,
+            "rendering": rendering,
         },
     )
 
@@ -123,3 +138,17 @@ def visualization_job_status_page(request, pk):
         return redirect("list_visualization_jobs", pk=pk)
     else:
         return render(request, "ppprint/vis_load.html")
+
+
+def metrics(request):
+    """Exports the timings and memory of all stages of the most recent jobs as Prometheus metrics, if enabled."""
+
+    if not settings.PPPRINT_METRICS:
+        raise Http404("Metrics are not enabled.")
+
+    limit = settings.PPPRINT_METRICS_JOBS
+    jobs = chain(
+        ImportJob.objects.order_by("-pk").prefetch_related("measurements")[:limit],
+        VisualizationJob.objects.order_by("-pk").prefetch_related("measurements")[:limit],
+    )
+    return HttpResponse(prometheus_text(jobs), content_type="text/plain; version=0.0.4")
@@ -108,3 +108,13 @@ COMBINED = [
 ]
 
 PLOTS = MDISORDER + TMSEG + PRONA + REPROF + COMBINED + ALL
+
+# Plots shown by each view of a comparison
+VIEWS = {
+    "overview": ALL,
+    "mdisorder": MDISORDER,
+    "tmseg": TMSEG,
+    "prona": PRONA,
+    "reprof": REPROF,
+    "combined": COMBINED,
+}
@@ -0,0 +1,157 @@
+"""
+Compares the distributions of many proteomes at once: all pairwise metrics are computed as matrices,
+which are ordered by hierarchical clustering so that similar proteomes end up next to each other.
+"""
+
+import math
+from typing import List, NamedTuple, Optional
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from scipy.cluster import hierarchy
+from scipy.spatial.distance import squareform
+
+# Pseudo count added to every bin, so that KL stays finite for empty bins
+PSEUDO_COUNT = math.exp(-12)
+
+
+class BinnedProteomes(NamedTuple):
+    """Bin counts of the values of all proteomes, one row per proteome."""
+
+    proteomes: List[int]
+    bins: np.ndarray
+    counts: np.ndarray
+    # Number of values per proteome, including those outside the bins
+    totals: np.ndarray
+    # Bootstrapped error bars of the bin values, if already computed
+    cis: Optional[np.ndarray] = None
+
+    @property
+    def distributions(self) -> np.ndarray:
+        """Bin values of every proteome, normalized as density, then relative to the sum over all bins."""
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            hist = self.counts / np.diff(self.bins)
+            return hist / hist.sum(axis=1, keepdims=True)
+
+
+def bin_proteomes(df: pd.DataFrame, arg: str, bins) -> BinnedProteomes:
+    """Bins the values of column `arg` of all proteomes in one pass."""
+
+    proteome = df["proteome"].astype("category").cat.remove_unused_categories()
+    codes = proteome.cat.codes.to_numpy().astype(np.int64)
+    proteomes = list(proteome.cat.categories)
+    bins = np.asarray(bins, float)
+
+    # Values outside the bins (or NaN) are not counted, as done by np.histogram
+    x = np.asarray(df[arg], float)
+    inside = (x >= bins[0]) & (x <= bins[-1])
+    # The last bin is closed on both sides
+    index = np.minimum(np.searchsorted(bins, x[inside], side="right") - 1, len(bins) - 2)
+    counts = np.bincount(
+        codes[inside] * (len(bins) - 1) + index,
+        minlength=len(proteomes) * (len(bins) - 1),
+    ).reshape(len(proteomes), len(bins) - 1)
+
+    return BinnedProteomes(proteomes, bins, counts, np.bincount(codes, minlength=len(proteomes)))
+
+
+def smoothed(distributions: np.ndarray) -> np.ndarray:
+    """Adds the pseudo count to every bin and renormalizes the rows."""
+
+    p = distributions + PSEUDO_COUNT
+    return p / p.sum(axis=1, keepdims=True)
+
+
+def kl_matrix(distributions: np.ndarray) -> np.ndarray:
+    """Returns the KL divergence of every pair of rows of a (proteomes x bins) array, KL(row i || row j) at (i, j)."""
+
+    p = smoothed(distributions)
+    log_p = np.log(p)
+    # KL(p_i || p_j) = sum(p_i * log p_i) - sum(p_i * log p_j)
+    kl = (p * log_p).sum(axis=1)[:, None] - p @ log_p.T
+    np.fill_diagonal(kl, 0.0)
+    return np.maximum(kl, 0.0)
+
+
+def js_matrix(distributions: np.ndarray) -> np.ndarray:
+    """Returns the (symmetric) Jensen-Shannon divergence of every pair of rows of a (proteomes x bins) array."""
+
+    p = smoothed(distributions)
+    # Mixture of every pair, (proteomes x proteomes x bins)
+    m = (p[:, None, :] + p[None, :, :]) / 2
+    entropy_p = (p * np.log(p)).sum(axis=1)
+    js = (entropy_p[:, None] + entropy_p[None, :]) / 2 - (m * np.log(m)).sum(axis=2)
+    np.fill_diagonal(js, 0.0)
+    return np.maximum(js, 0.0)
+
+
+def hellinger_matrix(distributions: np.ndarray) -> np.ndarray:
+    """Returns the Hellinger distance of every pair of rows of a (proteomes x bins) array."""
+
+    root = np.sqrt(smoothed(distributions))
+    # Via the Bhattacharyya coefficient of every pair
+    hellinger = np.sqrt(np.clip(1.0 - root @ root.T, 0.0, None))
+    np.fill_diagonal(hellinger, 0.0)
+    return hellinger
+
+
+DIVERGENCES = {
+    "KL": kl_matrix,
+    "JS": js_matrix,
+    "Hellinger": hellinger_matrix,
+}
+
+
+def cross_correlation_matrix(series: np.ndarray) -> np.ndarray:
+    """
+    Cross-correlates every pair of rows of a (proteomes x length) array, as `np.correlate(a, b, "same")`.
+    Returns a (proteomes x proteomes x length) array.
+    """
+
+    length = series.shape[1]
+    n = 2 * length - 1
+    spectra = np.fft.rfft(series, n)
+    full = np.fft.irfft(spectra[:, None, :] * spectra[None, :, :].conj(), n)
+    # Full correlations are indexed by lag (modulo n), "same" keeps the central lags
+    lags = np.arange(length) - length // 2
+    return full[..., lags % n]
+
+
+def cluster_order(distances: np.ndarray) -> np.ndarray:
+    """Returns an order of the proteomes that places proteomes with small (symmetrized) distances next to each other."""
+
+    if len(distances) <= 2 or not np.isfinite(distances).all():
+        return np.arange(len(distances))
+    symmetric = np.maximum((distances + distances.T) / 2, 0.0)
+    np.fill_diagonal(symmetric, 0.0)
+    linkage = hierarchy.linkage(
+        squareform(symmetric, checks=False), method="average", optimal_ordering=True
+    )
+    return hierarchy.leaves_list(linkage)
+
+
+def plot_matrix(matrix: np.ndarray, names: List[str], label: str, ax, annotate: bool = True, cmap=plt.cm.binary):
+    """Plots a pairwise metric of multiple proteomes as a heatmap, annotated with its values if requested."""
+
+    sns.heatmap(
+        matrix,
+        square=True,
+        xticklabels=names,
+        yticklabels=names,
+        cbar_kws={
+            "shrink": 0.5,
+            "label": label,
+        },
+        annot=annotate,
+        fmt=".2f",
+        annot_kws={"fontsize": 9},
+        ax=ax,
+        cmap=cmap,
+    )
+    # Fewer, smaller labels for many proteomes
+    fontsize = 9 if len(names) <= 20 else max(2, int(180 / len(names)))
+    ax.set_xticklabels(ax.get_xticklabels(), fontsize=fontsize)
+    ax.set_yticklabels(ax.get_yticklabels(), fontsize=fontsize)
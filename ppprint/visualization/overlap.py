@@ -0,0 +1,86 @@
+"""
+Finds overlapping regions of two features for all proteins of all proteomes at once.
+Regions are closed intervals [begin, end], any shared residue counts as overlap.
+"""
+
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def region_bounds(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns begin and end arrays of the regions of a region-based dataframe."""
+
+    return df["begin"].to_numpy(np.int64), df["end"].to_numpy(np.int64)
+
+
+def sort_keys(df_a: pd.DataFrame, df_b: pd.DataFrame):
+    """
+    Encodes proteome, protein and residue position into a single sortable integer for the regions of both dataframes.
+    Returns a function mapping positions of the regions of a dataframe to their keys.
+    """
+
+    frames = [df_a, df_b]
+    max_protein = max(int(df["protein"].max()) if len(df) else 0 for df in frames) + 1
+    max_position = max(int(df["end"].max()) if len(df) else 0 for df in frames) + 2
+
+    def keys(df: pd.DataFrame, positions: np.ndarray) -> np.ndarray:
+        proteins = df["proteome"].to_numpy(np.int64) * max_protein + df["protein"].to_numpy(np.int64)
+        return proteins * max_position + positions
+
+    return keys
+
+
+def count_overlaps(df_a: pd.DataFrame, df_b: pd.DataFrame) -> np.ndarray:
+    """Returns the number of regions of `df_b` overlapping each region of `df_a` (of the same protein)."""
+
+    keys = sort_keys(df_a, df_b)
+    begin_a, end_a = region_bounds(df_a)
+    begin_b, end_b = region_bounds(df_b)
+
+    # Regions of b that begin before a ends, without those that already end before a begins
+    begins = np.sort(keys(df_b, begin_b))
+    ends = np.sort(keys(df_b, end_b))
+    return np.searchsorted(begins, keys(df_a, end_a), side="right") - np.searchsorted(
+        ends, keys(df_a, begin_a), side="left"
+    )
+
+
+def overlap_pairs(df_a: pd.DataFrame, df_b: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns all pairs of overlapping regions, as positions "a" and "b" of the regions within `df_a` and `df_b`,
+    together with the number of shared residues.
+    """
+
+    keys = sort_keys(df_a, df_b)
+    begin_a, end_a = region_bounds(df_a)
+    begin_b, end_b = region_bounds(df_b)
+    order = np.argsort(keys(df_b, begin_b), kind="stable")
+    begins = keys(df_b, begin_b)[order]
+
+    # Candidates of a region of a begin at most one (maximum) region length of b before it
+    max_length = int((end_b - begin_b).max()) + 1 if len(df_b) else 0
+    lo = np.searchsorted(begins, keys(df_a, begin_a) - max_length, side="left")
+    hi = np.searchsorted(begins, keys(df_a, end_a), side="right")
+
+    counts = np.maximum(hi - lo, 0)
+    a = np.repeat(np.arange(len(df_a)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    b = order[np.repeat(lo, counts) + offsets]
+
+    # Candidates may still end before a begins (or belong to the previous protein)
+    shared = np.minimum(end_a[a], end_b[b]) - np.maximum(begin_a[a], begin_b[b]) + 1
+    same_protein = (df_a["proteome"].to_numpy()[a] == df_b["proteome"].to_numpy()[b]) & (
+        df_a["protein"].to_numpy()[a] == df_b["protein"].to_numpy()[b]
+    )
+    valid = same_protein & (shared > 0)
+
+    return pd.DataFrame({"a": a[valid], "b": b[valid], "residues": shared[valid]})
+
+
+def overlap_residues(df_a: pd.DataFrame, df_b: pd.DataFrame) -> np.ndarray:
+    """Returns the number of residues of each region of `df_a` shared with regions of `df_b` (summed over regions of b)."""
+
+    pairs = overlap_pairs(df_a, df_b)
+    return np.bincount(pairs["a"], weights=pairs["residues"], minlength=len(df_a)).astype(np.int64)
@@ -6,21 +6,52 @@ All plots to be used by ppprint have to correspond to subclasses of `Plot`.
 import logging
 import math
 from abc import ABC, abstractmethod
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, Set, Tuple
 
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
+import numpy as np
 import pandas as pd
 from scipy import stats
 
+from ppprint.visualization.comparison import BinnedProteomes, bin_proteomes
+from ppprint.visualization.plot_extras import ci_per_bin
+from ppprint.visualization.statistics import per_proteome
+
 logger = logging.getLogger(__name__)
 
+# Label of the figure shared by all plots rendered in a process
+FIGURE = "ppprint"
+
+# Parameters of the subplots that plots may adjust, reset for every plot
+SUBPLOT_PARAMS = ["left", "right", "bottom", "top", "wspace", "hspace"]
+
+
+@lru_cache(maxsize=None)
+def apply_style():
+    """Applies the style of all plots, once per process."""
+
+    plt.style.use("seaborn-whitegrid")
+
+
+def reset_figure() -> plt.Figure:
+    """Returns the shared figure of this process as the current figure, cleared and with default size and layout."""
+
+    fig = plt.figure(FIGURE, clear=True)
+    fig.set_size_inches(plt.rcParams["figure.figsize"])
+    fig.set_dpi(plt.rcParams["figure.dpi"])
+    fig.subplots_adjust(**{param: plt.rcParams[f"figure.subplot.{param}"] for param in SUBPLOT_PARAMS})
+    return fig
+
 
 class Plot(ABC):
     SOURCE_TYPE: str
     PLOT_NAME: str
     FILE_NAME: str
+    # Bump whenever the plot changes, invalidating its cached images
+    VERSION = 1
 
     base_folder: Path
     dataframes: Dict[str, pd.DataFrame]
@@ -46,22 +77,25 @@ class Plot(ABC):
         return self.dataframes[self.SOURCE_TYPE]
 
     def run(self):
-        # clear plot TODO object oriented?
-        plt.style.use("seaborn-whitegrid")
-        plt.clf()
-        plt.figure().clf()
-        plt.cla()
-        self._run(self.get_df())
-        self.set_title()
-        self.store_plot()
-        plt.close(plt.gcf())
+        apply_style()
+        fig = reset_figure()
+        figures = set(plt.get_fignums())
+        try:
+            self._run(self.get_df())
+            self.set_title()
+            self.store_plot()
+        finally:
+            # Close the figures created by the plot itself, the shared figure is cleared by the next plot
+            for num in set(plt.get_fignums()) - figures:
+                plt.close(num)
+            plt.figure(fig.number)
 
     def set_title(self):
         plt.title(self.PLOT_NAME)
 
     def store_plot(self):
         out_path = self.base_folder / f"{self.FILE_NAME}.png"
-        plt.savefig(out_path, dpi=200, bbox_inches="tight")
+        plt.gcf().savefig(out_path, dpi=200, bbox_inches="tight")
 
     def get_color_scheme(self):
         return {key: value[1] for key, value in self.proteome_mapping.items()}
@@ -81,19 +115,48 @@ class Plot(ABC):
             facecolor="white",
         )
 
+    def per_proteome(self, df, name, compute, **params):
+        """Returns a statistic of this plot for every proteome, reusing those cached by earlier comparisons."""
+
+        return per_proteome(df, name, compute, plot=type(self).__name__, **params)
+
+    def bin_proteomes(self, df, arg, bins, **filters) -> BinnedProteomes:
+        """Bins the values of all proteomes together with their error bars. Filters applied to `df` are part of the key."""
+
+        def compute(df_curr):
+            binned = bin_proteomes(df_curr, arg, bins)
+            cis = ci_per_bin(binned)
+            return {
+                p: (binned.counts[i], binned.totals[i], cis[p])
+                for i, p in enumerate(binned.proteomes)
+            }
+
+        bins = np.asarray(bins, float)
+        summaries = self.per_proteome(df, "bins", compute, arg=arg, bins=bins, **filters)
+        shape = (len(summaries), len(bins) - 1)
+        return BinnedProteomes(
+            list(summaries),
+            bins,
+            np.array([counts for counts, _, _ in summaries.values()]).reshape(shape),
+            np.array([total for _, total, _ in summaries.values()], dtype=np.int64),
+            np.array([cis for _, _, cis in summaries.values()]).reshape(shape),
+        )
+
     def add_mean_to_legend(self, df, arg, ax):
         """Calculates the mean and SEM of a column for each proteome and adds information to plot legend."""
 
-        df_means = df[["proteome", arg]].groupby("proteome").agg(["mean", stats.sem])
-        df_means.columns = df_means.columns.droplevel()
+        def compute(df_curr):
+            df_means = df_curr[["proteome", arg]].groupby("proteome", observed=True).agg(["mean", stats.sem])
+            df_means.columns = df_means.columns.droplevel()
+            return {p: (row["mean"], row["sem"]) for p, row in df_means.iterrows()}
+
+        means = self.per_proteome(df, "mean", compute, arg=arg)
 
         patches = []
         colors = self.get_color_scheme()
         names = self.get_proteome_names()
 
-        for p in pd.unique(df["proteome"]):
-            mean = df_means.at[p, "mean"]
-            sem = df_means.at[p, "sem"]
+        for p, (mean, sem) in means.items():
             conf = -int(math.log10(abs(sem + math.exp(-12)))) + 1
             patches.append(
                 mpatches.Patch(
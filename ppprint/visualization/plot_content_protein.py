@@ -55,8 +55,9 @@ class PContentPerProteinPlot(Plot):
         self.add_mean_to_legend(df, arg, ax1)
 
         # Calculate CIs and their positions
-        all_cis = ci_per_bin(df, arg, bins)
-        all_ys = val_per_bin(df, arg, bins)
+        binned = self.bin_proteomes(df, arg, bins)
+        all_cis = ci_per_bin(binned)
+        all_ys = val_per_bin(binned)
 
         # Calculate centers of bins for plotting
         half = float(bins[1] - bins[0]) / 2
@@ -66,7 +67,7 @@ class PContentPerProteinPlot(Plot):
         plot_errorbars(all_cis, bin_centers, all_ys, self.get_color_scheme(), ax1)
 
         # Calculate and plot KL
-        df_kl = kl_via_binning(df, arg, bins)
+        df_kl = kl_via_binning(binned)
         plot_kl(df_kl, self.get_proteome_names(), ax2)
 
         # Set true plot title
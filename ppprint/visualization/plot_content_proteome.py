@@ -20,7 +20,7 @@ class RContentPerProteomePlot(Plot, ABC):
         names = self.get_proteome_names()
         colors = self.get_color_scheme()
 
-        df_counts = df.groupby(["proteome"]).sum().reset_index()
+        df_counts = df.groupby(["proteome"], observed=True).sum().reset_index()
         df_counts["DR content"] = df_counts["reg length"] / df_counts["protein length"]
 
         sns.barplot(
@@ -38,7 +38,7 @@ class PContentPerProteomePlot(Plot):
         names = self.get_proteome_names()
         colors = self.get_color_scheme()
 
-        gb = pd.DataFrame(df.groupby("proteome")["protein length"].sum()).rename(
+        gb = pd.DataFrame(df.groupby("proteome", observed=True)["protein length"].sum()).rename(
             columns={"protein length": "sum protein length"}
         )
         df = df.join(gb, on="proteome", how="left")
@@ -93,7 +93,7 @@ class PCompositionPerProteomePlotMdisorder(Plot):
         colors = self.get_color_scheme()
 
         df["composition"] = (df["number of regions"] >= 1).replace({True: 1, False: 0})
-        df_sizes = pd.DataFrame(df.groupby("proteome").size()).rename(
+        df_sizes = pd.DataFrame(df.groupby("proteome", observed=True).size()).rename(
             columns={0: "proteome size"}
         )
         df = df.join(df_sizes, how="left", on=["proteome"])
@@ -1,87 +1,75 @@
-import itertools
-import math
-
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from scipy import stats
-import seaborn as sns
+from django.conf import settings
 
+from ppprint.visualization.comparison import DIVERGENCES, BinnedProteomes, cluster_order, plot_matrix
 
-def bin_proteome(df_curr, arg, bins):
-    """For a single proteome: Performs binning and returns bin values."""
+# Number of artificial proteomes drawn for bootstrapping
+BOOTSTRAP_SAMPLES = 1000
+# Seed of the default random generator, for reproducible error bars
+BOOTSTRAP_SEED = 0
 
-    x = np.asarray(df_curr[arg], float)
-    if x.ndim > 1:
-        x = x.squeeze()
 
-    bin_kws = dict(bins=bins)
-    hist_kws = {"density": True}
+def bootstrap_bins(counts, total, bins, m=BOOTSTRAP_SAMPLES, rng=None):
+    """
+    Returns the bin values (as of `BinnedProteomes.distributions`) of m artificial proteomes, resampled with replacement
+    from a proteome of `total` values with the given bin counts.
+    Instead of resampling the values themselves, the bin counts of all m proteomes are drawn from one multinomial distribution.
+    """
 
-    hist, bin_edges = np.histogram(
-        x,
-        **bin_kws,
-        **hist_kws,
-    )
-    hist = hist.astype(float) / hist.sum()
+    if rng is None:
+        rng = np.random.default_rng(BOOTSTRAP_SEED)
+    bins = np.asarray(bins, float)
+    if total == 0:
+        return np.full((m, len(bins) - 1), np.nan)
 
-    return hist
+    # Values outside the bins (or NaN) are drawn as well, but not counted (as done by np.histogram)
+    pvals = np.append(counts, total - counts.sum()) / total
+    samples = rng.multinomial(total, pvals, size=m)[:, :-1]
 
+    # Same normalization as `BinnedProteomes.distributions`: density, then relative to the sum over all bins
+    with np.errstate(invalid="ignore", divide="ignore"):
+        hist = samples / np.diff(bins)
+        return hist / hist.sum(axis=1, keepdims=True)
 
-def get_cis(df, p, bins, arg):
-    """For a single proteome p, performs SE/CI calculation via bootstrapping for bins."""
 
-    m = 1000
-    n = len(bins) - 1
+def get_cis(counts, total, bins, rng=None):
+    """For a single proteome given by its bin counts, performs SE/CI calculation via bootstrapping for bins."""
 
-    df_curr = df[df["proteome"] == p]
-    proteome_size = len(df_curr)
-    artificials = np.ndarray(shape=(n, m))
+    # Bin values of m(=1000)x artificial/sampled proteome data, one row per proteome
+    artificials = bootstrap_bins(counts, total, bins, rng=rng)
 
-    # Create m(=1000)x artificial/sampled proteome data
-    for j in range(0, m):
-        # Collect bin values for each (artificial) proteome of p
-        extra_df = df_curr.sample(n=proteome_size, replace=True)
-        bin_values = bin_proteome(extra_df, arg, bins)
-        artificials[:, j] = bin_values
+    # SE bootstrapping formula: SE=SD(bin) over all artificial proteomes
+    # CI formula: mean(/sum?) +- t_0.025 * SE
+    # For t, use Student's t-distriution for 1000-1 = 999 = ~inf DOF and conf level = 0.95 -> 1.960
+    t = 1.960
+    return artificials.std(axis=0) * t
 
-    # Calculate CIs for each bin
-    cis = np.ndarray(n)
-    for i in range(0, n):
-        # SE bootstrapping formula: SE=SD(bin) over all artificial proteomes
-        # CI formula: mean(/sum?) +- t_0.025 * SE
-        # For t, use Student's t-distriution for 1000-1 = 999 = ~inf DOF and conf level = 0.95 -> 1.960
-        t = 1.960
-        cis[i] = artificials[i].std() * t
 
-    return cis
+def proteome_rng(proteome, seed=BOOTSTRAP_SEED):
+    """Returns the random generator of a proteome, so that its error bars do not depend on the other proteomes compared."""
 
+    return np.random.default_rng([seed, int(proteome)])
 
-def ci_per_bin(df, arg, bins):
-    """Performs SE/CI calculation via bootstrapping for bins. Returns dictionary of CIs per proteome."""
 
-    proteomes = pd.unique(df["proteome"])
-    all_cis = {p: get_cis(df, p, bins, arg) for p in proteomes}
+def ci_per_bin(binned: BinnedProteomes, seed=BOOTSTRAP_SEED):
+    """Performs SE/CI calculation via bootstrapping for bins. Returns dictionary of CIs per proteome."""
 
-    return all_cis
+    if binned.cis is not None:
+        return dict(zip(binned.proteomes, binned.cis))
 
+    all_cis = {
+        p: get_cis(binned.counts[i], binned.totals[i], binned.bins, proteome_rng(p, seed))
+        for i, p in enumerate(binned.proteomes)
+    }
 
-def val_per_bin(df, arg, bins):
-    """Performs binning of original data to get positions for error bars."""
-    all_ys = {}
+    return all_cis
 
-    # Get positions for error bars
-    proteomes = pd.unique(df["proteome"])
-    for p in proteomes:
-        df_curr = df[df["proteome"] == p]
-        all_ys[p] = bin_proteome(df_curr, arg, bins)
 
-    # # Fill up for proteomes with less bins
-    # max_num_regions = len(max(all_ys.values(), key=lambda v: len(v)))
-    # for p in proteomes:
-    #     all_ys[p] = np.resize(all_ys[p], max_num_regions)
+def val_per_bin(binned: BinnedProteomes):
+    """Returns the bin values of the original data per proteome, as positions for error bars."""
 
-    return all_ys
+    return dict(zip(binned.proteomes, binned.distributions))
 
 
 def plot_errorbars(all_cis, bins, all_y, palette, ax):
@@ -100,61 +88,32 @@ def plot_errorbars(all_cis, bins, all_y, palette, ax):
         )
 
 
-def kl_via_binning(df, arg, bins):
-    """Calculates the KL divergence between the resulting distributions."""
-
-    proteomes = pd.unique(df["proteome"])
-    bin_values = {}
-    for p in proteomes:
-        # Get bin values and add pseudo counts
-        df_curr = df[df["proteome"] == p]
-        distribution = bin_proteome(df_curr, arg, bins)
-        bin_values[p] = distribution + math.exp(-12)
-
-    # Calculate kl for every pair
-    pairs = list(itertools.permutations(proteomes, 2))
-    df_kl = pd.DataFrame(
-        {
-            "first": [pair[0] for pair in pairs],
-            "second": [pair[1] for pair in pairs],
-            "value": [
-                round(stats.entropy(bin_values[pair[0]], bin_values[pair[1]]), 2)
-                for pair in pairs
-            ],
-        }
-    )
+def kl_via_binning(binned: BinnedProteomes, metric="KL"):
+    """Calculates a divergence (KL by default, see `DIVERGENCES`) between all pairs of the binned distributions."""
 
-    return df_kl
+    matrix = DIVERGENCES[metric](binned.distributions).round(2)
+    return pd.DataFrame(matrix, index=binned.proteomes, columns=binned.proteomes)
 
 
-def plot_kl(df_kl, name_mapping, ax):
-    """Plots a pairwise metric (KL) of multiple proteomes as specified in the given matrix in form of a heatmap."""
+def plot_kl(df_matrix, name_mapping, ax, label="KL"):
+    """
+    Plots a pairwise metric (KL) of multiple proteomes as specified in the given matrix in form of a heatmap.
+    Proteomes are ordered by clustering, values are only annotated for few proteomes.
+    """
 
-    if df_kl.empty:
-        df_matrix = np.zeros(shape=(1, 1))
-        names = name_mapping.values()
+    if len(df_matrix) <= 1:
+        matrix = np.zeros(shape=(1, 1))
+        names = list(name_mapping.values())
     else:
-        df_matrix = df_kl.pivot(index="first", columns="second", values="value").fillna(
-            0
-        )
-        names = list(name_mapping[p] for p in df_matrix.columns)
-        df_matrix.index.name = ""
-        df_matrix.columns.name = ""
-
-    sns.heatmap(
-        df_matrix,
-        square=True,
-        xticklabels=names,
-        yticklabels=names,
-        cbar_kws={
-            "shrink": 0.5,
-            "label": "KL",
-        },
-        annot=True,
-        annot_kws={"fontsize": 9},
-        ax=ax,
-        cmap=plt.cm.binary,
+        order = cluster_order(df_matrix.to_numpy())
+        matrix = df_matrix.to_numpy()[np.ix_(order, order)]
+        names = [name_mapping[df_matrix.index[i]] for i in order]
+
+    plot_matrix(
+        matrix,
+        names,
+        label,
+        ax,
+        annotate=len(names) <= settings.PPPRINT_PAIRWISE_PROTEOMES,
     )
-    ax.set_title("KL Between Whole Distributions", y=1.1)
-    ax.set_xticklabels(ax.get_xticklabels(), fontsize=9)
-    ax.set_yticklabels(ax.get_yticklabels(), fontsize=9)
+    ax.set_title(f"{label} Between Whole Distributions", y=1.1)
@@ -109,7 +109,7 @@ class PProtClassFractionsProna(Plot):
         )
 
         # Calculate sizes for relativity
-        df_sizes = pd.DataFrame(df.groupby("proteome").size()).rename(
+        df_sizes = pd.DataFrame(df.groupby("proteome", observed=True).size()).rename(
             columns={0: "proteome size"}
         )
         df_long = df_long.join(df_sizes, how="left", on=["proteome"])
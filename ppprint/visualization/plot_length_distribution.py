@@ -6,6 +6,7 @@ import numpy as np
 import pandas as pd
 import seaborn as sns
 
+from ppprint.visualization.overlap import count_overlaps, region_bounds
 from ppprint.visualization.plot import Plot
 from ppprint.visualization.plot_extras import (
     val_per_bin,
@@ -55,8 +56,9 @@ class PLengthDistributionPlot(Plot):
         ax1.set_ylim(0.0, 0.12)
 
         # Calculate CIs and their positions
-        all_cis = ci_per_bin(df, arg, bins)
-        all_ys = val_per_bin(df, arg, bins)
+        binned = self.bin_proteomes(df, arg, bins)
+        all_cis = ci_per_bin(binned)
+        all_ys = val_per_bin(binned)
 
         # Calculate centers of bins for plotting
         half = float(bins[1] - bins[0]) / 2
@@ -66,7 +68,7 @@ class PLengthDistributionPlot(Plot):
         plot_errorbars(all_cis, bin_centers, all_ys, self.get_color_scheme(), ax1)
 
         # Calculate and plot KL
-        df_kl = kl_via_binning(df, arg, bins)
+        df_kl = kl_via_binning(binned)
         plot_kl(df_kl, self.get_proteome_names(), ax2)
 
         # Set true plot title
@@ -129,8 +131,9 @@ class RLengthDistributionPlot(Plot):
         ax1.set_ylim(bottom=0.0, top=(ylim[1] + 0.08))
 
         # Calculate CIs and their positions
-        all_cis = ci_per_bin(df, arg, bins)
-        all_ys = val_per_bin(df, arg, bins)
+        binned = self.bin_proteomes(df, arg, bins)
+        all_cis = ci_per_bin(binned)
+        all_ys = val_per_bin(binned)
 
         # Calculate centers of bins for plotting
         half = float(bins[1] - bins[0]) / 2
@@ -140,7 +143,7 @@ class RLengthDistributionPlot(Plot):
         plot_errorbars(all_cis, bin_centers, all_ys, self.get_color_scheme(), ax1)
 
         # Calculate and plot KL
-        df_kl = kl_via_binning(df, arg, bins)
+        df_kl = kl_via_binning(binned)
         plot_kl(df_kl, self.get_proteome_names(), ax2)
 
         # Set true plot title
@@ -217,38 +220,20 @@ class RLengthsPlotAbsMdisorderProna(Plot):
     MAXLENGTH = 51
     STEPSIZE = 5
 
-    def overlap_for_pbr(self, df: pd.DataFrame):
-        # One protein in this df -> step through/check for each PBR
-        # Note: (1) this far, we used PBR length as number of residues to count (here we have RI)
-        #       (2) any overlap counts
-        df_pbr = df[df["feature"] == "prona"]
-        df_dr = df[df["feature"] == "mdisorder"]
-        num_res_in_drs = 0
-        res_in_drs_list = []
-        for i in df_pbr.index:
-            start = df_pbr.at[i, "start"]
-            end = df_pbr.at[i, "end"]
-            num_overlap = len(df_dr[~((df_dr["start"] > end) | (df_dr["end"] < start))])
-            if num_overlap > 0:
-                valid_length = end - start + 1
-                num_res_in_drs += valid_length
-                res_in_drs_list.append(valid_length)
-        return num_res_in_drs
-
     def _run(self, df_mdisorder: pd.DataFrame):
         fig, ax1 = plt.subplots()
 
         df_prona = self.dataframes["prona rbased"]
         df_sizes = (
             self.dataframes["mdisorder pbased"][["proteome", "protein length"]]
-            .groupby("proteome")
+            .groupby("proteome", observed=True)
             .sum()
         )
 
         # Fraction of residues in DRs
 
         df_mdisorder_counts = (
-            df_mdisorder[["proteome", "reg length"]].groupby(["proteome"]).sum()
+            df_mdisorder[["proteome", "reg length"]].groupby(["proteome"], observed=True).sum()
         )
         df_mdisorder_counts = df_mdisorder_counts.join(
             df_sizes, on="proteome", how="left"
@@ -259,23 +244,23 @@ class RLengthsPlotAbsMdisorderProna(Plot):
 
         # Fraction of disordered residues used in protein binding
 
-        df_mdisorder["feature"] = ["mdisorder"] * len(df_mdisorder)
-        df_prona["feature"] = ["prona"] * len(df_prona)
-        df_all = pd.concat([df_mdisorder, df_prona])
-        df_all["start"], df_all["end"] = zip(*df_all["region"])
-
-        # Calculate number of overlapping residues for each proteome
-        grouped = df_all.groupby(["proteome", "protein"])
-
-        overlap_series = grouped.apply(func=self.overlap_for_pbr)
-        overlap_series.name = "overlap"
+        # Calculate number of residues in PBRs overlapping any DR for each protein
+        begin, end = region_bounds(df_prona)
+        in_drs = count_overlaps(df_prona, df_mdisorder) > 0
+        df_overlap = df_prona[["proteome", "protein"]].assign(
+            value=np.where(in_drs, end - begin + 1, 0)
+        )
         hue = "proteome"
-        dpbrs = overlap_series[overlap_series.notnull()]
+        proteins = pd.concat(
+            [df_mdisorder[["proteome", "protein"]], df_prona[["proteome", "protein"]]]
+        ).drop_duplicates()
         dpbrs = (
-            dpbrs.apply(pd.Series)
-            .reset_index()
-            .melt(id_vars=["proteome", "protein"])
-            .dropna()[["proteome", "protein", "value"]]
+            proteins.merge(
+                df_overlap.groupby(["proteome", "protein"], as_index=False, observed=True).sum(),
+                how="left",
+            )
+            .fillna(0)
+            .sort_values(["proteome", "protein"], kind="stable")
         )
 
         # bins = [6, 11, 16, 21, 26, 31, 41, 51, 101, max(111, max(dpbrs["value"]))]
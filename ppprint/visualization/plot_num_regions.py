@@ -62,8 +62,9 @@ class PNumberOfRegions(Plot):
         self.add_mean_to_legend(df, "number of regions", ax1)
 
         # Calculate CIs and their positions
-        all_cis = ci_per_bin(df, arg, bins)
-        all_ys = val_per_bin(df, arg, bins)
+        binned = self.bin_proteomes(df, arg, bins)
+        all_cis = ci_per_bin(binned)
+        all_ys = val_per_bin(binned)
 
         # Calculate centers of bins for plotting
         half = float(bins[1] - bins[0]) / 2
@@ -73,7 +74,7 @@ class PNumberOfRegions(Plot):
         plot_errorbars(all_cis, bin_centers, all_ys, self.get_color_scheme(), ax1)
 
         # Calculate and plot KL
-        df_kl = kl_via_binning(df, arg, bins)
+        df_kl = kl_via_binning(binned)
         plot_kl(df_kl, self.get_proteome_names(), ax2)
 
         # Set true plot title
@@ -145,7 +146,8 @@ class PNumberOfRegTopoTmseg(Plot):
 
         # Cytoplasmic half
 
-        df_half = df[df["orientation"] == "Cytoplasmic"]
+        orientation = "Cytoplasmic"
+        df_half = df[df["orientation"] == orientation]
         self.plot_half(df_half)
         y_blim = -self.ax1.get_ylim()[1]
 
@@ -157,8 +159,9 @@ class PNumberOfRegTopoTmseg(Plot):
         #     line.set_ydata(-line.get_ydata())
 
         # Calculate CIs and their positions, turn upside down
-        all_cis = ci_per_bin(df_half, "number of regions", self.bins)
-        all_ys = val_per_bin(df_half, "number of regions", self.bins)
+        binned = self.bin_proteomes(df_half, "number of regions", self.bins, orientation=orientation)
+        all_cis = ci_per_bin(binned)
+        all_ys = val_per_bin(binned)
         for p, ys in all_ys.items():
             all_ys[p] = -ys
 
@@ -171,13 +174,15 @@ class PNumberOfRegTopoTmseg(Plot):
 
         # Extracellular half
 
-        df_half = df[df["orientation"] == "Extracellular"]
+        orientation = "Extracellular"
+        df_half = df[df["orientation"] == orientation]
         self.plot_half(df_half)
         y_ulim = self.ax1.get_ylim()[1]
 
         # Calculate CIs and their positions
-        all_cis = ci_per_bin(df_half, "number of regions", self.bins)
-        all_ys = val_per_bin(df_half, "number of regions", self.bins)
+        binned = self.bin_proteomes(df_half, "number of regions", self.bins, orientation=orientation)
+        all_cis = ci_per_bin(binned)
+        all_ys = val_per_bin(binned)
 
         # Calculate centers of bins for plotting
         half = float(self.bins[1] - self.bins[0]) / 2
@@ -3,6 +3,7 @@ import numpy as np
 import pandas as pd
 import seaborn as sns
 
+from ppprint.visualization.overlap import count_overlaps
 from ppprint.visualization.plot import Plot
 
 
@@ -11,39 +12,20 @@ class RRegionPlotMdisorderProna(Plot):
     PLOT_NAME = "Distribution of Number of PBRs Per DR"
     FILE_NAME = "mixed_mdis_prona_r_pbr_per_dr"
 
-    def overlap_for_dr(self, df: pd.DataFrame):
-        # One protein in this df -> step through/check for each DR
-        # Note: (1) counting number of PBRs per DR
-        #       (2) any overlap counts
-        df_pbr = df[df["feature"] == "prona"]
-        df_dr = df[df["feature"] == "mdisorder"]
-        pbrs_per_dr = []
-        for i in df_dr.index:
-            start = df_dr.at[i, "start"]
-            end = df_dr.at[i, "end"]
-            num_overlap = len(
-                df_pbr[~((df_pbr["start"] > end) | (df_pbr["end"] < start))]
-            )
-            pbrs_per_dr.append(num_overlap)
-        if not pbrs_per_dr:
-            # No DR, do not include
-            return None
-        return pbrs_per_dr
-
     def _run(self, df_mdisorder: pd.DataFrame):
         fig, ax1 = plt.subplots()
 
         df_prona = self.dataframes["prona rbased"]
         df_sizes = (
             self.dataframes["mdisorder pbased"][["proteome", "protein length"]]
-            .groupby("proteome")
+            .groupby("proteome", observed=True)
             .sum()
         )
 
         # Fraction of residues in DRs
 
         df_mdisorder_counts = (
-            df_mdisorder[["proteome", "reg length"]].groupby(["proteome"]).sum()
+            df_mdisorder[["proteome", "reg length"]].groupby(["proteome"], observed=True).sum()
         )
         df_mdisorder_counts = df_mdisorder_counts.join(
             df_sizes, on="proteome", how="left"
@@ -54,23 +36,11 @@ class RRegionPlotMdisorderProna(Plot):
 
         # Fraction of disordered residues used in protein binding
 
-        df_mdisorder["feature"] = ["mdisorder"] * len(df_mdisorder)
-        df_prona["feature"] = ["prona"] * len(df_prona)
-        df_all = pd.concat([df_mdisorder, df_prona])
-        df_all["start"], df_all["end"] = zip(*df_all["region"])
-
-        # Calculate number of overlapping residues for each proteome
-        grouped = df_all.groupby(["proteome", "protein"])
-
-        overlap_series = grouped.apply(func=self.overlap_for_dr)
-        overlap_series.name = "overlap"
-        proteins_with_drs = overlap_series[overlap_series.notnull()]
-        drs = (
-            proteins_with_drs.apply(pd.Series)
-            .reset_index()
-            .melt(id_vars=["proteome", "protein"])
-            .dropna()[["proteome", "protein", "value"]]
+        # Number of PBRs overlapping each DR (any overlap counts)
+        drs = df_mdisorder[["proteome", "protein"]].assign(
+            value=count_overlaps(df_mdisorder, df_prona)
         )
+        drs = drs.sort_values(["proteome", "protein"], kind="stable")
 
         discrete = True
         # Bins are overwritten by seaborn when plotting hist
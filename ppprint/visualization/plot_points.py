@@ -1,58 +1,71 @@
+from typing import List
+
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import seaborn as sns
 
 from ppprint.visualization.plot import Plot
+from ppprint.visualization.statistics import split_by_proteome
+
+
+def grid_indices(points: np.ndarray) -> np.ndarray:
+    """Returns the indices of the points on the grid in steps of 0.01, rounding them as `round(x, 2)` does."""
+
+    scaled = points * 100
+    indices = np.rint(scaled)
+    # Halfway products may stem from points slightly off the middle, which `round` decides by their exact value
+    ties = np.nonzero(scaled - np.floor(scaled) == 0.5)[0]
+    indices[ties] = [round(round(x, 2) * 100) for x in points[ties].tolist()]
+    return indices.astype(np.int64)
 
 
 class RPointLinePlot(Plot):
-    def split_point_regions(self, df: pd.DataFrame):
-        """Extracts all points covered by the given regions in point format."""
-
-        # To ensure a consecutive index
-        df = df.reset_index(drop=True)
-
-        touched_points = []
-        points_proteomes = []
-        points_descriptions = []
-        for i, pr in enumerate(df["point region"]):
-            # Append each touched point (round to 2 decimals)
-            t = [
-                round(x, 2)
-                for x in list(
-                    np.arange(round(pr[0], 2), round(pr[1], 2) + 0.001, step=0.01)
-                )
-            ]
-            touched_points.extend(t)
-            # Add proteome information
-            p = df.at[i, "proteome"]
-            points_proteomes.extend([p for _ in range(0, len(t))])
-            # Add description information
-            d = df.at[i, "description"]
-            points_descriptions.extend([d for _ in range(0, len(t))])
-
-        df_result = pd.DataFrame(
-            {
-                "touched point": touched_points,
-                "proteome": points_proteomes,
-                "description": points_descriptions,
-            }
-        )
+    # Grid of points in protein, in steps of 0.01
+    NUM_POINTS = 101
+    VERSION = 2
+
+    def point_coverage(self, df: pd.DataFrame, by: List[str]):
+        """
+        Counts how often each grid point is covered by the given regions in point format, per group of `by` columns.
+        Returns the covered points with their frequency (relative to all covered points of the group).
+        """
+
+        begins = grid_indices(df["point begin"].to_numpy(np.float64))
+        ends = grid_indices(df["point end"].to_numpy(np.float64))
+        codes, groups = pd.MultiIndex.from_frame(df[by]).factorize()
+
+        # Difference array over the grid: +1 where a region begins, -1 after it ends
+        diff = np.zeros((len(groups), self.NUM_POINTS + 1), dtype=np.int64)
+        np.add.at(diff, (codes, begins), 1)
+        np.add.at(diff, (codes, ends + 1), -1)
+        coverage = np.cumsum(diff, axis=1)[:, : self.NUM_POINTS]
+        frequency = coverage / coverage.sum(axis=1, keepdims=True)
+
+        # Only covered points, in order of first occurrence of the groups
+        group, point = np.nonzero(coverage)
+        df_result = groups[group].set_names(by).to_frame(index=False)
+        df_result.insert(0, "touched point", point / 100)
+        df_result["value"] = frequency[group, point]
         return df_result
 
+    def cached_coverage(self, df: pd.DataFrame, by: List[str]):
+        """Point coverage (see `point_coverage`) per proteome, reusing the coverage cached by earlier comparisons."""
+
+        def compute(df_curr):
+            return split_by_proteome(self.point_coverage(df_curr, by), pd.unique(df_curr["proteome"]))
+
+        coverages = self.per_proteome(df, "coverage", compute, by=by)
+        return pd.concat(list(coverages.values()), ignore_index=True)
+
     def _run(self, df: pd.DataFrame):
         ax1 = plt.subplot()
 
-        df_splitreg = self.split_point_regions(df)
+        df_coverage = self.cached_coverage(df, ["proteome"])
 
-        sizes = pd.DataFrame(df_splitreg.groupby(["proteome"]).size()).rename(
-            {0: "proteome size"}, axis=1
-        )
-        df_splitreg = df_splitreg.join(sizes, how="left", on="proteome")
-        df_splitreg["value"] = 1 / df_splitreg["proteome size"]
+        # One row per point and proteome
         sns.lineplot(
-            data=df_splitreg,
+            data=df_coverage,
             x="touched point",
             y="value",
             estimator=sum,
@@ -99,17 +112,11 @@ class RPointLinePlotReprof(RPointLinePlot):
     def _run(self, df: pd.DataFrame):
         ax1 = plt.subplot()
 
-        df_splitreg = self.split_point_regions(df)
+        df_coverage = self.cached_coverage(df, ["proteome", "description"])
 
-        sizes = pd.DataFrame(
-            df_splitreg.groupby(["proteome", "description"]).size()
-        ).rename({0: "proteome size"}, axis=1)
-        df_splitreg = df_splitreg.join(
-            sizes, how="left", on=["proteome", "description"]
-        )
-        df_splitreg["value"] = 1 / df_splitreg["proteome size"]
+        # One row per point, proteome and description
         sns.lineplot(
-            data=df_splitreg,
+            data=df_coverage,
             x="touched point",
             y="value",
             estimator=sum,
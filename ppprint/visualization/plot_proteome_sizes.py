@@ -16,7 +16,7 @@ class PProteomeSizes(Plot):
     def _run(self, df: pd.DataFrame):
         ax1 = plt.subplot()
 
-        sizes = df.groupby(["proteome"]).size().to_frame("size")
+        sizes = df.groupby(["proteome"], observed=True).size().to_frame("size")
 
         names = self.get_proteome_names()
         sizes = sizes.join(
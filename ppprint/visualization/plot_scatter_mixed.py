@@ -1,7 +1,9 @@
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import seaborn as sns
 
+from ppprint.visualization.overlap import count_overlaps, region_bounds
 from ppprint.visualization.plot import Plot
 
 
@@ -10,38 +12,20 @@ class RScatterPlotMdisorderProna(Plot):
     PLOT_NAME = "Relative Overlap of TMPs and Disordered Proteins"
     FILE_NAME = "mixed_mdis_prona_r_scatter"
 
-    def overlap_for_pbr(self, df: pd.DataFrame):
-        # One protein in this df -> step through/check for each PBR
-        # Note: (1) this far, we used PBR length as number of residues to count (here we have RI)
-        #       (2) any overlap counts
-        df_pbr = df[df["feature"] == "prona"]
-        df_dr = df[df["feature"] == "mdisorder"]
-        num_res_in_drs = 0
-        res_in_drs_list = []
-        for i in df_pbr.index:
-            start = df_pbr.at[i, "start"]
-            end = df_pbr.at[i, "end"]
-            num_overlap = len(df_dr[~((df_dr["start"] > end) | (df_dr["end"] < start))])
-            if num_overlap > 0:
-                valid_length = end - start + 1
-                num_res_in_drs += valid_length
-                res_in_drs_list.append(valid_length)
-        return num_res_in_drs
-
     def _run(self, df_mdisorder: pd.DataFrame):
         fig, ax1 = plt.subplots()
 
         df_prona = self.dataframes["prona rbased"]
         df_sizes = (
             self.dataframes["mdisorder pbased"][["proteome", "protein length"]]
-            .groupby("proteome")
+            .groupby("proteome", observed=True)
             .sum()
         )
 
         # Fraction of residues in DRs
 
         df_mdisorder_counts = (
-            df_mdisorder[["proteome", "reg length"]].groupby(["proteome"]).sum()
+            df_mdisorder[["proteome", "reg length"]].groupby(["proteome"], observed=True).sum()
         )
         df_mdisorder_counts = df_mdisorder_counts.join(
             df_sizes, on="proteome", how="left"
@@ -52,19 +36,14 @@ class RScatterPlotMdisorderProna(Plot):
 
         # Fraction of disordered residues used in protein binding
 
-        df_mdisorder["feature"] = ["mdisorder"] * len(df_mdisorder)
-        df_prona["feature"] = ["prona"] * len(df_prona)
-        df_all = pd.concat([df_mdisorder, df_prona])
-        df_all["start"], df_all["end"] = zip(*df_all["region"])
-
-        # Calculate number of overlapping residues for each proteome
-        grouped = df_all.groupby(["proteome", "protein"])
-
-        overlap_series = grouped.apply(func=self.overlap_for_pbr)
-        overlap_series.name = "overlap"
-        grouped = (
-            grouped.count().join(overlap_series, how="right").groupby("proteome").sum()
+        # Calculate number of residues in PBRs overlapping any DR for each proteome
+        begin, end = region_bounds(df_prona)
+        in_drs = count_overlaps(df_prona, df_mdisorder) > 0
+        df_overlap = df_prona[["proteome"]].assign(overlap=np.where(in_drs, end - begin + 1, 0))
+        proteomes = pd.Index(
+            sorted(set(df_mdisorder["proteome"]) | set(df_prona["proteome"])), name="proteome"
         )
+        grouped = df_overlap.groupby("proteome", observed=True).sum().reindex(proteomes, fill_value=0)
         # Calculate relative
         # (1) Normalized by number of residues in proteome
         # df_prona_counts = grouped[["overlap"]].join(df_sizes)
@@ -8,10 +8,13 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import seaborn as sns
+from django.conf import settings
 from matplotlib import gridspec
 from scipy import stats
 
+from ppprint.visualization.comparison import cluster_order, cross_correlation_matrix, plot_matrix
 from ppprint.visualization.plot import Plot
+from ppprint.visualization.statistics import split_by_proteome
 
 
 class RSpectrumPlotMdisorder(Plot):
@@ -22,20 +25,18 @@ class RSpectrumPlotMdisorder(Plot):
     def collect_lists(self, df: pd.DataFrame):
         """Determines center and distance from start to center for each region and adds info to dataframe."""
 
-        df["start"], df["end"] = zip(*df["point region"])
-        df["y"] = df[["start", "end"]].mean(axis=1).round(decimals=2)
-        df["x"] = -(df["y"] - df["start"])
+        # Centers are matched against the grid of center positions, which requires double precision
+        points = df[["point begin", "point end"]].astype("float64")
+        y = points.mean(axis=1).round(decimals=2)
         # Select only columns of interest
-        df = df[["x", "y", "proteome"]]
-
-        return df
+        return pd.DataFrame({"x": -(y - points["point begin"]), "y": y, "proteome": df["proteome"]})
 
     def group_and_metrics(self, df_points: pd.DataFrame):
         """Calculates metrics for a spectrum plot. Returns a dataframe with data ('binned' per center), means, SEs."""
 
         # Calculate stats
         df_grouped = (
-            df_points.groupby(["proteome", "y"])
+            df_points.groupby(["proteome", "y"], observed=True)
             .agg(
                 **{
                     "mean": pd.NamedAgg(column="x", aggfunc="mean"),
@@ -193,37 +194,51 @@ class RSpectrumPlotMdisorder(Plot):
         )
         ax.add_artist(extra_legend)
 
+    def plot_spectrum_matrix(self, ax, widths, names):
+        """Plots the spectra of many proteomes as a heatmap, one row per proteome."""
+
+        image = ax.imshow(
+            widths,
+            aspect="auto",
+            interpolation="nearest",
+            extent=(-0.005, 1.005, len(names) - 0.5, -0.5),
+            cmap=plt.cm.viridis,
+        )
+        plt.colorbar(image, ax=ax, label="Start/end of DR in Protein", shrink=0.8)
+        ax.grid(False)
+        ax.set_yticks(np.arange(len(names)))
+        ax.set_yticklabels(names, fontsize=9 if len(names) <= 20 else max(2, int(180 / len(names))))
+        ax.set_xticks(np.arange(0.0, 1.05, 0.1))
+        ax.set_xlabel("Position of Center of DR in Protein", loc="center")
+        ax.set_title(
+            "Width of DRs at Center Positions", pad=7, backgroundcolor=(0, 0, 0, 0.1)
+        )
+
     def _run(self, df: pd.DataFrame):
-        """Creates a spectrum plot."""
+        """Creates a spectrum plot. Beyond a few proteomes, spectra and cross-correlations are shown as clustered matrices."""
 
         # -- Preprocessing --
 
-        proteomes = pd.unique(df["proteome"])
+        proteomes = list(pd.unique(df["proteome"]))
         n = len(proteomes)
-        assert n <= 4  # TODO: Ensure this when creating a VisualizationJob
 
-        # Get points df
-        df_points = self.collect_lists(df)
+        # Get points df and calculate SE, per proteome
+        def compute(df_curr):
+            df_grouped = self.group_and_metrics(self.collect_lists(df_curr))
+            return split_by_proteome(df_grouped, pd.unique(df_curr["proteome"]))
 
-        # Calculate SE
-        df_grouped = self.group_and_metrics(df_points)
+        df_grouped = pd.concat(list(self.per_proteome(df, "spectrum", compute).values()), ignore_index=True)
 
         # # Add pseudo counts
         # df_grouped["mean"] -= math.exp(-12)
 
-        def get_means(df, proteome):
-            """For a given proteome, gets the mean column as a series with a reset index."""
-            return df[df["proteome"] == proteome]["mean"].reset_index(drop=True)
-
-        proteome_pairs = list(itertools.combinations(proteomes, 2))
-        all_cross_corr = []
-        for pair in proteome_pairs:
-            # Calculate cross-correlation
-            cross_corr = get_means(df_grouped, pair[0]).corr(
-                get_means(df_grouped, pair[1]),
-                method=(lambda a, b: np.correlate(a, b, "same")),
-            )
-            all_cross_corr.append(cross_corr)
+        # Cross-correlations of the means of all pairs of proteomes at once
+        means = (
+            df_grouped.pivot(index="proteome", columns="y", values="mean")
+            .loc[proteomes]
+            .to_numpy()
+        )
+        all_cross_corr = cross_correlation_matrix(means)
 
         # -- Plotting --
 
@@ -231,10 +246,25 @@ class RSpectrumPlotMdisorder(Plot):
         gs = gridspec.GridSpec(2, 1, height_ratios=[6, 11])
         ax1 = plt.subplot(gs[0])
         ax2 = plt.subplot(gs[1])
+        names = self.get_proteome_names()
+
+        if n > settings.PPPRINT_PAIRWISE_PROTEOMES:
+            # Peak CC of every pair, similar proteomes next to each other
+            peaks = all_cross_corr.max(axis=2)
+            order = cluster_order(peaks.max() - peaks)
+            ordered_names = [names[proteomes[i]] for i in order]
+            plot_matrix(peaks[np.ix_(order, order)], ordered_names, "Peak CC", ax2, annotate=False)
+            ax2.set_title("Peak Cross-Correlation", fontsize=10, backgroundcolor=(0, 0, 0, 0.1))
+
+            fig.set_size_inches(8, 14)
+            fig.tight_layout(pad=2)
+            self.plot_spectrum_matrix(ax1, -means[order], ordered_names)
+            return
 
         # Plot paired CC
-        names = self.get_proteome_names()
-        self.plot_cc(names, proteome_pairs, all_cross_corr, ax2)
+        pairs = list(itertools.combinations(range(n), 2))
+        proteome_pairs = [(proteomes[i], proteomes[j]) for i, j in pairs]
+        self.plot_cc(names, proteome_pairs, [all_cross_corr[i, j] for i, j in pairs], ax2)
 
         # Insert background into CC plot
         self.plot_background(ax2)
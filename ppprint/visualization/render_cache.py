@@ -0,0 +1,101 @@
+"""
+Cache of rendered plots, so that comparisons of the same proteomes with the same colors
+link the images of an earlier comparison instead of rendering them again.
+Least recently used images are evicted once the cache exceeds its disk budget.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, Tuple, Type
+
+from django.conf import settings
+from matplotlib.colors import to_hex
+
+from ppprint.preprocessing.cache import link_or_copy
+from ppprint.visualization.plot import Plot
+
+# Bump whenever all plots change, e.g. their resolution, invalidating all cached images
+RENDER_CACHE_VERSION = 1
+
+
+def get_render_cache_folder() -> Path:
+    return (
+        Path(settings.BASE_DIR)
+        / settings.MEDIA_ROOT
+        / "render_cache"
+        / f"v{RENDER_CACHE_VERSION}"
+    )
+
+
+def render_key(
+    plot_cls: Type[Plot], mapping: Dict[int, Tuple[str, Tuple[float, float, float]]]
+) -> str:
+    """Returns a digest identifying a plot rendered for a set of proteomes with their names and colors."""
+
+    description = json.dumps(
+        {
+            "plot": plot_cls.__name__,
+            "version": plot_cls.VERSION,
+            "proteomes": sorted(mapping),
+            # In order of the mapping, which is the order of the legends
+            "mapping": [[pk, name, to_hex(rgb)] for pk, (name, rgb) in mapping.items()],
+        }
+    )
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+def get_render_path(plot_cls: Type[Plot], mapping: Dict) -> Path:
+    return get_render_cache_folder() / f"{render_key(plot_cls, mapping)}.png"
+
+
+def restore_plot(plot_cls: Type[Plot], mapping: Dict, base_folder: Path) -> bool:
+    """Links a cached image of a plot to `base_folder`. Returns whether there was one."""
+
+    cache_path = get_render_path(plot_cls, mapping)
+    try:
+        link_or_copy(cache_path, base_folder / f"{plot_cls.FILE_NAME}.png")
+    except FileNotFoundError:
+        return False
+    # Mark as recently used, eviction goes by modification time
+    try:
+        os.utime(cache_path)
+    except FileNotFoundError:
+        # Evicted meanwhile, the linked image is kept anyway
+        pass
+    return True
+
+
+def cache_plot(plot_cls: Type[Plot], mapping: Dict, base_folder: Path):
+    """Adds a rendered image of a plot to the cache."""
+
+    cache_path = get_render_path(plot_cls, mapping)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    link_or_copy(base_folder / f"{plot_cls.FILE_NAME}.png", cache_path)
+
+
+def evict(budget: int):
+    """Removes the least recently used images until the cache takes at most `budget` bytes."""
+
+    folder = get_render_cache_folder()
+    if not folder.exists():
+        return
+
+    entries = []
+    for entry in os.scandir(folder):
+        # Skips temporary files of images being added
+        if entry.name.endswith(".png"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    size = sum(entry_size for _, entry_size, _ in entries)
+    for _, entry_size, path in sorted(entries):
+        if size <= budget:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Evicted by a concurrent job
+            pass
+        size -= entry_size
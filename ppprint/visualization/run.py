@@ -3,25 +3,166 @@ Collects dataframes for all proteomes required by the comparison
 and runs plotting of all `Plot` subclasses.
 """
 
-from collections import defaultdict
-from itertools import chain
+import colorsys
+import logging
+import os
+import time
+from itertools import chain, count
 from pathlib import Path
-from typing import Dict, Tuple
+from typing import Dict, Iterator, List, Mapping, Optional, Sequence, Tuple, Type, Union
 
+import matplotlib.pyplot as plt
+from matplotlib.colors import to_hex
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+from billiard.pool import Pool
 from django.conf import settings
 
 from ppprint.models import VisualizationJob
+from ppprint.preprocessing.utils import LoggedException
+from ppprint.profiling import Profile, measure, merge, recording
 from ppprint.visualization import PLOTS
+from ppprint.visualization.plot import Plot
+from ppprint.visualization.render_cache import cache_plot, evict, restore_plot
 
 
-def run(visualization_job_pk: int, data: Dict[int, Dict[str, pd.DataFrame]]):
-    result_dict, mapping, base_folder = prepare(visualization_job_pk, data)
-    run_plotting(result_dict, mapping, base_folder)
+logger = logging.getLogger(__name__)
+
+# Seconds after which a view that is still marked as being rendered is rendered again
+RENDER_TIMEOUT = 30 * 60
+
+# Plot classes by name, as sent to the tasks rendering single plots
+PLOTS_BY_NAME = {plot_cls.__name__: plot_cls for plot_cls in PLOTS}
+
+# Dataframes of the running comparison, shared with the plot workers by forking after they are set
+shared = {}
+
+
+def run(
+    visualization_job_pk: int,
+    data: Dict[int, Dict[str, pd.DataFrame]],
+    plots: Sequence[Type[Plot]] = PLOTS,
+):
+    """Renders the given plots of a comparison, except for those whose images already exist."""
+
+    vj = VisualizationJob.objects.get(pk=visualization_job_pk)
+    mapping = get_mapping(vj)
+    base_folder = get_visualization_folder(visualization_job_pk)
+
+    missing = pending_plots(plots, mapping, base_folder)
+    messages = []
+    if missing:
+        messages = run_plotting(concat_proteomes(data), mapping, base_folder, missing)
+        if settings.PPPRINT_RENDER_CACHE:
+            for plot_cls in missing:
+                cache_rendered(plot_cls, mapping, base_folder)
+            evict(settings.PPPRINT_RENDER_CACHE_SIZE)
+
+    if messages:
+        vj.add_messages(messages)
+        if len(messages) == len(plots):
+            raise LoggedException("Could not create any plots.")
+
+
+def pending_plots(plots: Sequence[Type[Plot]], mapping: Dict, base_folder: Path) -> List[Type[Plot]]:
+    """Returns the plots that still need to be rendered, linking images of earlier comparisons if cached."""
+
+    missing = [plot_cls for plot_cls in plots if not (base_folder / f"{plot_cls.FILE_NAME}.png").exists()]
+    if settings.PPPRINT_RENDER_CACHE:
+        # Images of comparisons of the same proteomes and colors are linked, only the others are rendered
+        missing = [plot_cls for plot_cls in missing if not restore_plot(plot_cls, mapping, base_folder)]
+    return missing
+
+
+def cache_rendered(plot_cls: Type[Plot], mapping: Dict, base_folder: Path):
+    """Adds the image of a plot to the render cache, unless the plot failed."""
+
+    if (base_folder / f"{plot_cls.FILE_NAME}.png").exists():
+        cache_plot(plot_cls, mapping, base_folder)
+
+
+def render_job_plot(
+    visualization_job_pk: int, data: Dict[int, Mapping[str, pd.DataFrame]], plot_cls: Type[Plot]
+) -> Optional[str]:
+    """
+    Renders a single plot of a comparison within the calling process, concatenating only the dataframes it uses.
+    Returns a message for the user if the plot failed.
+    """
+
+    mapping = get_mapping(VisualizationJob.objects.get(pk=visualization_job_pk))
+    base_folder = get_visualization_folder(visualization_job_pk)
+    shared.update(dataframes=ConcatenatedProteomes(data), mapping=mapping, base_folder=base_folder)
+    try:
+        message, profile = render_plot(plot_cls)
+        merge(profile)
+    finally:
+        shared.clear()
+    if settings.PPPRINT_RENDER_CACHE:
+        cache_rendered(plot_cls, mapping, base_folder)
+    return message
+
+
+def view_marker(visualization_job_pk: int, view: str, state: str) -> Path:
+    return get_visualization_folder(visualization_job_pk) / f".{view}.{state}"
+
+
+def view_rendered(visualization_job_pk: int, view: str) -> bool:
+    return view_marker(visualization_job_pk, view, "rendered").exists()
+
+
+def claim_view(visualization_job_pk: int, view: str) -> bool:
+    """
+    Marks a view of a comparison as being rendered, so that concurrent requests render it only once.
+    Returns False if the view is already rendered or being rendered.
+    """
+
+    marker = view_marker(visualization_job_pk, view, "rendering")
+    while not view_rendered(visualization_job_pk, view):
+        try:
+            os.close(os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            pass
+        try:
+            # Take over views whose rendering was interrupted, e.g. by a lost worker
+            if time.time() - marker.stat().st_mtime < RENDER_TIMEOUT:
+                return False
+            os.utime(marker)
+            return True
+        except FileNotFoundError:
+            # Finished meanwhile, or failed and released
+            continue
+    return False
+
+
+def finish_view(visualization_job_pk: int, view: str):
+    """Marks a view as rendered, also if some of its plots failed."""
+
+    view_marker(visualization_job_pk, view, "rendered").touch()
+    view_marker(visualization_job_pk, view, "rendering").unlink(missing_ok=True)
+
+
+def generate_colors() -> Iterator[Tuple[str, Tuple[float, float, float]]]:
+    """Generates further colors for large comparisons, with hues spread by the golden ratio."""
+
+    for i in count():
+        rgb = colorsys.hls_to_rgb((i * 0.618033988749895) % 1.0, 0.5, 0.65)
+        yield to_hex(rgb), rgb
 
 
 def prepare(visualization_job_pk: int, data: Dict[int, Dict[str, pd.DataFrame]]):
     vj = VisualizationJob.objects.get(pk=visualization_job_pk)
+    mapping = get_mapping(vj)
+    result = concat_proteomes(data)
+    base_folder = get_visualization_folder(visualization_job_pk)
+
+    return dict(result), mapping, base_folder
+    # run_plotting(dict(result), mapping, base_folder)
+
+
+def get_mapping(vj: VisualizationJob) -> Dict[int, Tuple[str, Tuple[float, float, float]]]:
+    """Maps the pks of the compared proteomes to their names and colors, choosing colors for those without one."""
 
     mapping = {}
     colors = {
@@ -36,7 +177,7 @@ def prepare(visualization_job_pk: int, data: Dict[int, Dict[str, pd.DataFrame]])
         "#102e5c": (0.06274509803921569, 0.1803921568627451, 0.3607843137254902),
     }
     used_colors = set()
-    new_color_generator = iter(colors.items())
+    new_color_generator = chain(colors.items(), generate_colors())
     duplicated = []
 
     # Add all proteomes with set colors to mapping
@@ -57,8 +198,10 @@ def prepare(visualization_job_pk: int, data: Dict[int, Dict[str, pd.DataFrame]])
         # Add chosen color to used_colors in order to find a new one for the next proteome
         used_colors.add(color[0])
 
-    result = concat_proteomes(data)
+    return mapping
+
 
+def get_visualization_folder(visualization_job_pk: int) -> Path:
     base_folder = (
         Path(settings.BASE_DIR)
         / settings.MEDIA_ROOT
@@ -66,28 +209,113 @@ def prepare(visualization_job_pk: int, data: Dict[int, Dict[str, pd.DataFrame]])
         / str(visualization_job_pk)
     )
     base_folder.mkdir(exist_ok=True, parents=True)
+    return base_folder
+
+
+def concat_columns(arrays: List) -> Union[np.ndarray, pd.Categorical]:
+    """Concatenates the arrays of a column of all proteomes, merging the categories of categorical columns."""
+
+    if len(arrays) == 1:
+        return arrays[0]
+    if isinstance(arrays[0], pd.Categorical):
+        return union_categoricals(arrays)
+    return np.concatenate(arrays)
 
-    return dict(result), mapping, base_folder
-    # run_plotting(dict(result), mapping, base_folder)
 
+def concat_proteomes(data: Dict[int, Mapping[str, pd.DataFrame]]) -> Dict[str, pd.DataFrame]:
+    """
+    Builds one dataframe per source type with all requested proteomes, keyed by a categorical "proteome" column of pks.
+    Every column is concatenated only once and the dataframes of the proteomes are not modified.
+    With a single proteome, its columns are used as they are, without copying.
+    """
 
-def concat_proteomes(data):
-    """Adds proteome IDs (pks) to dataframe and builds big source type df with all requested proteomes."""
+    source_types = dict.fromkeys(chain.from_iterable(data.values()))
+    return {source_type: concat_source_type(data, source_type) for source_type in source_types}
 
-    result = defaultdict(pd.DataFrame)
-    for proteome_id, dataset in data.items():
-        for source_type, df in dataset.items():
-            df["proteome"] = proteome_id
-            result[source_type] = pd.concat(
-                [result[source_type], df], ignore_index=True
-            )
-    return result
+
+def concat_source_type(data: Dict[int, Mapping[str, pd.DataFrame]], source_type: str) -> pd.DataFrame:
+    """Builds the dataframe of a single source type with all requested proteomes, see `concat_proteomes`."""
+
+    proteomes = sorted(data)
+    with measure("concat"):
+        frames = [data[proteome][source_type] for proteome in proteomes]
+        columns = {
+            column: concat_columns([df[column].values for df in frames])
+            for column in frames[0].columns
+        }
+        columns["proteome"] = pd.Categorical.from_codes(
+            np.repeat(np.arange(len(frames)), [len(df) for df in frames]), proteomes
+        )
+        return pd.DataFrame(columns, copy=False)
+
+
+class ConcatenatedProteomes(Mapping):
+    """Mapping of source types to the dataframes of all requested proteomes, each concatenated on first access."""
+
+    def __init__(self, data: Dict[int, Mapping[str, pd.DataFrame]]):
+        self.data = data
+        self.source_types = list(dict.fromkeys(chain.from_iterable(data.values())))
+        self.loaded: Dict[str, pd.DataFrame] = {}
+
+    def __getitem__(self, source_type: str) -> pd.DataFrame:
+        if source_type not in self.source_types:
+            raise KeyError(source_type)
+        if source_type not in self.loaded:
+            self.loaded[source_type] = concat_source_type(self.data, source_type)
+        return self.loaded[source_type]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.source_types)
+
+    def __len__(self) -> int:
+        return len(self.source_types)
+
+
+def render_plot(plot_cls: Type[Plot]) -> Tuple[Optional[str], Profile]:
+    """
+    Renders a single plot from the shared dataframes.
+    Returns a message for the user if the plot failed, together with the timings of the plot.
+    """
+
+    with recording(Profile()) as profile, measure(f"plot {plot_cls.__name__}"):
+        try:
+            plot_cls(shared["dataframes"], shared["mapping"], shared["base_folder"]).run()
+        except Exception:
+            logger.exception(f"Failed to render {plot_cls.__name__}")
+            plt.close("all")
+            return f"Could not create plot {plot_cls.PLOT_NAME}.", profile
+    return None, profile
 
 
 def run_plotting(
     dataframes: Dict[str, pd.DataFrame],
     mapping: Dict[int, Tuple[str, Tuple[float, float, float]]],
     base_folder: Path,
-):
-    for plot_cls in PLOTS:
-        plot_cls(dataframes, mapping, base_folder).run()
+    plots: Sequence[Type[Plot]] = PLOTS,
+) -> List[str]:
+    """
+    Renders the given plots, in a pool of worker processes if configured. Failures of single plots do not stop the others.
+    Returns messages for all failed plots.
+    """
+
+    workers = settings.PPPRINT_PLOT_WORKERS
+    shared.update(dataframes=dataframes, mapping=mapping, base_folder=base_folder)
+    try:
+        if workers <= 1:
+            results = [render_plot(plot_cls) for plot_cls in plots]
+        else:
+            # Workers are forked after the dataframes are set, so only the plot classes are sent to them
+            with Pool(processes=workers) as pool:
+                # One result per plot, as billiard counts the results of `map` towards a single worker,
+                # keeping the other workers waiting for their results to be consumed when they exit
+                results = [pool.apply_async(render_plot, (plot_cls,)) for plot_cls in plots]
+                results = [result.get() for result in results]
+                # Let the workers exit on their own instead of terminating them
+                pool.close()
+                pool.join()
+    finally:
+        shared.clear()
+
+    for _, profile in results:
+        merge(profile)
+    return [message for message, _ in results if message]
@@ -0,0 +1,98 @@
+"""
+Cache of per-proteome statistics of the plots (bin counts, error bars, means, coverage profiles, ...),
+stored next to the results of each ImportJob. Comparisons of already imported proteomes
+only combine the cached summaries of their proteomes instead of recomputing them from all rows.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from ppprint.preprocessing.run import get_base_folder
+
+# Bump whenever a cached statistic is computed differently, invalidating all cached statistics
+STATISTICS_VERSION = 2
+
+
+def get_statistics_folder(import_job_pk: int) -> Path:
+    return get_base_folder(import_job_pk) / "statistics" / f"v{STATISTICS_VERSION}"
+
+
+def statistics_key(name: str, params: Dict) -> str:
+    """Returns a digest identifying a statistic and the parameters (bins, columns, filters) it was computed with."""
+
+    def default(value):
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        if isinstance(value, np.generic):
+            return value.item()
+        raise TypeError(f"Cannot use {value!r} as a statistics parameter")
+
+    description = json.dumps({"name": name, **params}, sort_keys=True, default=default)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+def load_statistic(import_job_pk: int, key: str) -> Optional[Any]:
+    try:
+        with open(get_statistics_folder(import_job_pk) / f"{key}.pickle", "rb") as f:
+            return pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def store_statistic(import_job_pk: int, key: str, value: Any):
+    folder = get_statistics_folder(import_job_pk)
+    folder.mkdir(parents=True, exist_ok=True)
+    # Plot workers may store the same statistic concurrently
+    tmp_path = folder / f".{key}.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(value, f)
+    os.replace(tmp_path, folder / f"{key}.pickle")
+
+
+def per_proteome(
+    df: pd.DataFrame, name: str, compute: Callable[[pd.DataFrame], Dict[int, Any]], **params
+) -> Dict[int, Any]:
+    """
+    Returns a statistic for every proteome of `df`, in order of the proteomes.
+    `compute` returns the statistic for all proteomes of the rows it is given. It is only called once,
+    with the rows of the proteomes whose statistic is not yet cached.
+    """
+
+    proteome = df["proteome"]
+    proteomes = list(pd.unique(proteome))
+    if not settings.PPPRINT_STATISTICS_CACHE:
+        computed = compute(df)
+        return {p: computed[p] for p in proteomes}
+
+    key = statistics_key(name, params)
+    results = {}
+    for p in proteomes:
+        value = load_statistic(p, key)
+        if value is not None:
+            results[p] = value
+
+    missing = [p for p in proteomes if p not in results]
+    if missing:
+        computed = compute(df[proteome.isin(missing)] if results else df)
+        for p in missing:
+            store_statistic(p, key, computed[p])
+            results[p] = computed[p]
+
+    return {p: results[p] for p in proteomes}
+
+
+def split_by_proteome(df: pd.DataFrame, proteomes) -> Dict[int, pd.DataFrame]:
+    """Splits a dataframe of statistics of multiple proteomes into one (possibly empty) dataframe per proteome."""
+
+    # Plain proteome pks, as the categories differ between comparisons
+    df = df.assign(proteome=df["proteome"].to_numpy(np.int64))
+    groups = df.groupby("proteome", sort=False).indices
+    return {p: df.iloc[groups.get(p, [])].reset_index(drop=True) for p in proteomes}
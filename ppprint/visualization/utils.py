@@ -18,14 +18,14 @@ def test_plots(visualization_job_pk, plot_cls):
     job = VisualizationJob.objects.get(pk=visualization_job_pk)
     results = {}
     for source in job.sources.all():  # sources are ImportJobs
-        json_path = (
+        data_path = (
             Path(settings.BASE_DIR)
             / settings.MEDIA_ROOT
             / "import_job"
             / str(source.pk)
-            / "data.json"
+            / "data.npz"
         )
-        results[source.pk] = run_info(json_path)
+        results[source.pk] = run_info(data_path)
 
     result_dict, mapping, base_folder = prepare(visualization_job_pk, results)
 
@@ -1,8 +1,10 @@
 from pathlib import Path
 from typing import Dict
+import numpy as np
 import pandas as pd
 from django.conf import settings
 
+from ppprint.preprocessing.extract import tmseg_topology
 from ppprint.preprocessing.run import run_info
 from tests.steps.utils import build_true_dfs_pbased, build_true_dfs_rbased
 
@@ -33,3 +35,46 @@ def test_extract():
     # Region-based
     true_results = build_true_dfs_rbased()
     compare_sources()
+
+
+def test_tmseg_topology():
+    """Tests whether the topology of TMPs matches looking up the first TMH of each protein one by one."""
+
+    rng = np.random.default_rng(0)
+    descriptions = ["Transmembrane Helix", "Cytoplasmic", "Extracellular", "Signal Peptide"]
+    cases = [
+        pd.DataFrame(
+            {
+                "protein": rng.integers(0, 20, n),
+                "description": rng.choice(descriptions, n, p=[0.3, 0.3, 0.3, 0.1]),
+            }
+        )
+        for n in rng.integers(1, 60, 50)
+    ]
+    # A protein starting with a TMH, one with a single TMH only and one without TMH
+    cases.append(
+        pd.DataFrame(
+            {
+                "protein": [2, 2, 5, 7, 7],
+                "description": [
+                    "Transmembrane Helix",
+                    "Cytoplasmic",
+                    "Transmembrane Helix",
+                    "Extracellular",
+                    "Cytoplasmic",
+                ],
+            }
+        )
+    )
+
+    for df_source in cases:
+        expected = {}
+        for protein, df_protein in df_source.groupby("protein"):
+            regions = list(df_protein["description"])
+            if "Transmembrane Helix" in regions:
+                first = regions.index("Transmembrane Helix")
+                orientation = regions[first - 1] if first > 0 else "Membrane"
+                expected[protein] = (first, regions[0], orientation)
+
+        df_topology = tmseg_topology(df_source)
+        assert {protein: tuple(row) for protein, row in df_topology.iterrows()} == expected
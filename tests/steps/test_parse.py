@@ -1,16 +1,33 @@
 import shutil
+import tarfile
 import os
 from http import HTTPStatus
 from unittest.mock import patch
 import json
+import numpy as np
 import pytest
+import pandas as pd
 from pathlib import Path
 from django.conf import settings
 
-from ppprint.preprocessing.run import extract_data, write_json, LoggedException
+from ppprint.preprocessing.cache import hash_file
+from ppprint.preprocessing.extract import read_data, read_json
+from ppprint.preprocessing.messages import MessageCollector, collecting, collectors, get_collector
+from ppprint.preprocessing.parse import filter_segments, group_segments, write_data
+from ppprint.preprocessing.run import (
+    extract_data,
+    get_checkpoint,
+    get_data_path,
+    run_info,
+    run_stage,
+    store,
+    LoggedException,
+)
+from ppprint.preprocessing.store import ResultStore
 from ppprint.models import ImportJob, StatusChoices
+from ppprint.profiling import CLEAR_REFS, Profile, measure, recording
 from ppprint.tasks import run_import_job
-from tests.steps.utils import build_true_segments_json, convert_mdisorder_to_latin1
+from tests.steps.utils import build_true_segments_json, convert_mdisorder_to_latin1, write_json
 
 
 def test_extract_tarfile():
@@ -79,7 +96,7 @@ def test_import(client):
     run_import_job(pk)
 
     assert ImportJob.objects.get(pk=pk).status == StatusChoices.SUCCESS
-    assert (Path(settings.BASE_DIR) / settings.MEDIA_ROOT / "import_job" / str(pk) / "results.pickle").exists()
+    assert (Path(settings.BASE_DIR) / settings.MEDIA_ROOT / "import_job" / str(pk) / "results" / "manifest.json").exists()
 
 
 @pytest.mark.django_db()
@@ -163,7 +180,7 @@ def test_corrupt_files(client):
     assert messages[0].text == "Could not FIND P62524.reprof in job_1."
     assert messages[1].text == "Could not PARSE Q8XA85.mdisorder in job_1."
     # Parsing result file should still exist
-    assert (Path(settings.BASE_DIR) / settings.MEDIA_ROOT / "import_job" / str(ij.pk) / "results.pickle").exists()
+    assert (Path(settings.BASE_DIR) / settings.MEDIA_ROOT / "import_job" / str(ij.pk) / "results" / "manifest.json").exists()
     # Job status should not be failure
     assert ij.status == StatusChoices.SUCCESS
 
@@ -191,3 +208,269 @@ def test_latin1_files(client, import_job_factory):
     # Assert job did not throw error messages
     assert ij.messages.count() == 0
 
+
+
+@pytest.mark.django_db()
+def test_stream_archive(import_job_factory, tmp_path):
+    """
+    Tests whether parsing the members straight from an archive yields the same proteins as parsing
+    the extracted job folders.
+    """
+
+    # Create ImportJob
+    ij = import_job_factory(Path(settings.BASE_DIR) / "tests" / "data" / "sarscov2")
+
+    base_folder = Path(settings.BASE_DIR) / settings.MEDIA_ROOT / "import_job" / str(ij.pk)
+    archive = tmp_path / "sarscov2.tar.gz"
+    with tarfile.open(archive, "w:gz") as tf:
+        for job_folder in sorted(p for p in base_folder.iterdir() if p.is_dir()):
+            tf.add(job_folder, arcname=job_folder.name)
+
+    json_path_folders = tmp_path / "folders.json"
+    json_path_archive = tmp_path / "archive.json"
+    write_json(base_folder, json_path_folders, ij.pk)
+    write_json(archive, json_path_archive, ij.pk)
+
+    with open(json_path_folders, "r") as f:
+        data_folders = json.load(f)
+    with open(json_path_archive, "r") as f:
+        data_archive = json.load(f)
+
+    assert len(data_archive) == 16
+    key = lambda p: p["sequence"]
+    assert sorted(data_archive, key=key) == sorted(data_folders, key=key)
+
+
+@pytest.mark.django_db()
+def test_stream_scattered_archive(import_job_factory, settings, tmp_path):
+    """
+    Tests whether an archive whose job folders are not stored consecutively is unpacked instead of streamed,
+    yielding the same proteins as the job folders.
+    """
+
+    source_folder = Path(settings.BASE_DIR) / "tests" / "data" / "sarscov2"
+    upload_folder = tmp_path / "upload"
+    upload_folder.mkdir()
+    # Members ordered by file type, so that every job folder reappears after the others
+    files = sorted(source_folder.glob("job_*/*"), key=lambda p: (p.suffix, p.parent.name, p.name))
+    with tarfile.open(upload_folder / "scattered.tar", "w") as tf:
+        for path in files:
+            tf.add(path, arcname=f"{path.parent.name}/{path.name}")
+
+    imports = {}
+    for streaming in [True, False]:
+        settings.PPPRINT_STREAMING_IMPORT = streaming
+        ij = import_job_factory(upload_folder)
+        with collecting(ij.pk):
+            for stage in ["unpack", "parse"]:
+                run_stage(ij.pk, stage)
+        imports[streaming] = (read_data(get_data_path(ij.pk)), sorted(m.text for m in ij.messages.all()))
+
+    (df_archive, df_seq_archive), messages_archive = imports[True]
+    (df_folders, df_seq_folders), messages_folders = imports[False]
+    assert len(df_seq_archive) == 16
+    pd.testing.assert_frame_equal(df_archive, df_folders)
+    pd.testing.assert_frame_equal(df_seq_archive, df_seq_folders)
+    # Messages of the interrupted streaming are dropped, only those of parsing the unpacked folders are kept
+    assert messages_archive == messages_folders
+    assert messages_archive
+
+
+@pytest.mark.django_db()
+def test_parse_parallel(import_job_factory, settings, tmp_path):
+    """Tests whether parsing job folders in a pool of workers returns the proteins in the same order as parsing serially."""
+
+    # Create ImportJob
+    ij = import_job_factory(Path(settings.BASE_DIR) / "tests" / "data" / "sarscov2")
+    base_folder = Path(settings.BASE_DIR) / settings.MEDIA_ROOT / "import_job" / str(ij.pk)
+
+    data = []
+    for workers in [1, 4]:
+        settings.PPPRINT_PARSE_WORKERS = workers
+        settings.PPPRINT_PARSE_BATCH_SIZE = 3
+        json_path = tmp_path / f"data_{workers}.json"
+        write_json(base_folder, json_path, ij.pk)
+        with open(json_path, "r") as f:
+            data.append(json.load(f))
+
+    assert len(data[0]) == 16
+    assert data[0] == data[1]
+
+
+def test_group_segments():
+    """Tests whether segments are grouped and filtered correctly for annotation strings and lists of class codes."""
+
+    type_dict = {"H": "Helix", "E": "Strand"}
+    segments = filter_segments(group_segments("HHLLEEEHL", type_dict), type_dict)
+    assert segments == [
+        {"begin": 1, "end": 2, "description": "Helix"},
+        {"begin": 5, "end": 7, "description": "Strand"},
+        {"begin": 8, "end": 8, "description": "Helix"},
+    ]
+
+    type_dict = {"P2": "Protein Binding (RI: 67-100)"}
+    segments = filter_segments(group_segments([".", "P2", "P2", "P1"], type_dict), type_dict)
+    assert segments == [{"begin": 2, "end": 3, "description": "Protein Binding (RI: 67-100)"}]
+
+    assert filter_segments(group_segments("", type_dict), type_dict) == []
+
+
+@pytest.mark.django_db()
+def test_columnar_data(import_job_factory, tmp_path):
+    """Tests whether the columnar tables are read into the same dataframes as the JSON."""
+
+    # Create ImportJob
+    ij = import_job_factory(Path(settings.BASE_DIR) / "tests" / "data" / "sarscov2")
+
+    base_folder = Path(settings.BASE_DIR) / settings.MEDIA_ROOT / "import_job" / str(ij.pk)
+    json_path = tmp_path / "data.json"
+    data_path = tmp_path / "data.npz"
+    write_json(base_folder, json_path, ij.pk)
+    write_data(base_folder, data_path, ij.pk)
+
+    df_json, df_seq_json = read_json(json_path)
+    df_data, df_seq_data = read_data(data_path)
+
+    assert len(df_seq_data) == 16
+    pd.testing.assert_frame_equal(df_data, df_json)
+    pd.testing.assert_frame_equal(df_seq_data, df_seq_json)
+
+
+@pytest.mark.django_db()
+def test_aggregate_messages(import_job_factory):
+    """Tests whether repeated warnings are aggregated with a capped number of examples and stored at once."""
+
+    # Create ImportJob
+    ij = import_job_factory(Path(settings.BASE_DIR) / "tests" / "data" / "sarscov2")
+
+    worker = MessageCollector(max_examples=2)
+    for protein in ["P1", "P2", "P3"]:
+        worker.add(f"Could not FIND {protein}.reprof in job_1.", "proteins missing .reprof", f"{protein} in job_1")
+    worker.add("Could not PARSE P4.mdisorder in job_2.", "proteins with unparseable .mdisorder", "P4 in job_2")
+    worker.add("Duplicate warning.")
+    worker.add("Duplicate warning.")
+
+    with collecting(ij.pk):
+        collector = get_collector(ij.pk)
+        collector.max_examples = 2
+        collector.update(worker)
+        assert len(collector) == 6
+    assert ij.pk not in collectors
+
+    assert [m.text for m in ij.messages.order_by("pk")] == [
+        "3 proteins missing .reprof, e.g. P1 in job_1, P2 in job_1, ...",
+        "Could not PARSE P4.mdisorder in job_2.",
+        "Duplicate warning. (2 times)",
+    ]
+
+
+@pytest.mark.django_db()
+def test_import_cache(client):
+    """Tests whether a re-upload of an identical archive reuses the results of the first import without parsing."""
+
+    data_path = Path(settings.BASE_DIR) / "tests" / "data" / "sarscov2" / "sarscov2.tar.gz"
+    pks = []
+    for name in ["first", "second"]:
+        with patch("ppprint.tasks.run_import_job.delay"):
+            with open(data_path, "rb") as f:
+                client.post("/upload", {"name": name, "file": f, "color": "#000000"})
+        pks.append(ImportJob.objects.get(name=name).pk)
+
+    with patch("ppprint.tasks.run_stage", wraps=run_stage) as mock_stage:
+        for pk in pks:
+            run_import_job(pk)
+        assert {call.args[0] for call in mock_stage.call_args_list} == {pks[0]}
+
+    # The digest is computed while saving the upload
+    assert {ij.sha256 for ij in ImportJob.objects.all()} == {hash_file(data_path)}
+    results = [Path(settings.BASE_DIR) / settings.MEDIA_ROOT / "import_job" / str(pk) / "results" for pk in pks]
+    assert ImportJob.objects.get(pk=pks[1]).status == StatusChoices.SUCCESS
+    assert sorted(os.listdir(results[0])) == sorted(os.listdir(results[1]))
+    for name in os.listdir(results[0]):
+        assert (results[0] / name).read_bytes() == (results[1] / name).read_bytes()
+
+
+@pytest.mark.django_db()
+def test_result_store(import_job_factory, tmp_path):
+    """Tests whether the stored results are loaded lazily and equal to the extracted dataframes."""
+
+    ij = import_job_factory(Path(settings.BASE_DIR) / "tests" / "data" / "sarscov2")
+    for stage in ["unpack", "parse"]:
+        run_stage(ij.pk, stage)
+    results = run_info(get_data_path(ij.pk))
+    store(results, tmp_path / "results")
+
+    stored = ResultStore(tmp_path / "results")
+    assert list(stored) == list(results)
+    assert not stored.loaded
+    for source_type, df in results.items():
+        pd.testing.assert_frame_equal(stored[source_type], df, obj=source_type)
+    assert stored.loaded.keys() == results.keys()
+
+
+@pytest.mark.django_db()
+def test_resume_import(import_job_factory, settings):
+    """Tests whether an interrupted import resumes with the first stage that was not completed before."""
+
+    settings.PPPRINT_IMPORT_CACHE = False
+    ij = import_job_factory(Path(settings.BASE_DIR) / "tests" / "data" / "sarscov2")
+    for stage in ["unpack", "parse"]:
+        run_stage(ij.pk, stage)
+        assert get_checkpoint(ij.pk, stage).exists()
+
+    with patch("ppprint.preprocessing.run.write_data", side_effect=AssertionError("parsed again")):
+        run_import_job(ij.pk)
+
+    assert ImportJob.objects.get(pk=ij.pk).status == StatusChoices.SUCCESS
+    assert get_checkpoint(ij.pk, "extract").exists()
+    assert ResultStore(Path(settings.BASE_DIR) / settings.MEDIA_ROOT / "import_job" / str(ij.pk) / "results")
+
+
+@pytest.mark.django_db()
+def test_import_profile(client, import_job_factory, settings):
+    """Tests whether the stages of an import are measured, stored with the job and exported as metrics."""
+
+    settings.PPPRINT_IMPORT_CACHE = False
+    ij = import_job_factory(Path(settings.BASE_DIR) / "tests" / "data" / "sarscov2")
+    run_import_job(ij.pk)
+
+    measurements = {m.stage: m for m in ImportJob.objects.get(pk=ij.pk).measurements.all()}
+    for stage in ["unpack", "parse", "extract", "parse tmseg", "read_data", "extract_rbased_mdisorder"]:
+        assert stage in measurements
+    # One call per parsed .fasta, summed over the parse workers
+    assert measurements["parse fasta"].calls == 16
+    assert measurements["extract"].wall_time >= measurements["read_data"].wall_time > 0
+    assert measurements["extract"].peak_rss > 0
+    # Extractions count the CPU time of their thread, the enclosing stage that of all of them
+    assert measurements["extract"].cpu_time >= sum(
+        m.cpu_time for stage, m in measurements.items() if stage.startswith("extract_")
+    )
+
+    # Not exported unless enabled
+    assert client.get("/metrics").status_code == HTTPStatus.NOT_FOUND
+
+    settings.PPPRINT_METRICS = True
+    response = client.get("/metrics")
+    assert response.status_code == HTTPStatus.OK
+    assert f'ppprint_stage_calls{{job="import",pk="{ij.pk}",stage="parse fasta"}} 16' in response.content.decode()
+
+    # Only the most recent jobs are exported
+    ImportJob.objects.create(name="later").measurements.create(stage="unpack", wall_time=1, cpu_time=1, peak_rss=1)
+    settings.PPPRINT_METRICS_JOBS = 1
+    assert f'pk="{ij.pk}"' not in client.get("/metrics").content.decode()
+
+
+@pytest.mark.skipif(not CLEAR_REFS.exists(), reason="peak RSS can only be reset on Linux")
+def test_peak_rss_per_stage():
+    """Tests whether the peak RSS of a stage excludes earlier stages, but is included in enclosing ones."""
+
+    with recording(Profile()) as profile:
+        with measure("outer"):
+            with measure("allocate"):
+                data = np.ones(256 * 1024**2 // 8)
+                del data
+            with measure("idle"):
+                pass
+
+    peak = {stage: entry[3] for stage, entry in profile.stages.items()}
+    assert peak["outer"] >= peak["allocate"] >= peak["idle"] + 128 * 1024**2
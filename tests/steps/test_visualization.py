@@ -0,0 +1,397 @@
+import os
+import shutil
+from http import HTTPStatus
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import entropy
+from django.conf import settings
+
+from ppprint.models import StatusChoices, VisualizationJob
+from ppprint.preprocessing.run import get_result_folder, load, run_stage
+from ppprint.visualization.comparison import (
+    bin_proteomes,
+    cluster_order,
+    cross_correlation_matrix,
+    hellinger_matrix,
+    js_matrix,
+    kl_matrix,
+    smoothed,
+)
+from ppprint.visualization.overlap import count_overlaps, overlap_pairs, overlap_residues
+from ppprint.visualization.plot_content_relate import PContentRelatePlotReprof
+from ppprint.visualization.plot_points import RPointLinePlotReprof, grid_indices
+from ppprint.visualization.plot_spectrum import RSpectrumPlotMdisorder
+from ppprint.visualization.render_cache import evict, get_render_cache_folder, get_render_path
+from ppprint.tasks import fail_plots, run_visualization_job
+from ppprint.visualization.run import (
+    claim_view,
+    get_mapping,
+    get_visualization_folder,
+    run,
+    run_plotting,
+    view_marker,
+)
+
+
+@pytest.fixture
+def imported_proteomes(import_job_factory):
+    """Fixture to import the sarscov2 proteome once and copy its results to further ImportJobs."""
+
+    def get_jobs(n: int):
+        jobs = [import_job_factory(Path(settings.BASE_DIR) / "tests" / "data" / "sarscov2") for _ in range(n)]
+        for stage in ["unpack", "parse", "extract"]:
+            run_stage(jobs[0].pk, stage)
+        for ij in jobs[1:]:
+            shutil.copytree(get_result_folder(jobs[0].pk), get_result_folder(ij.pk))
+        return jobs
+
+    return get_jobs
+
+
+@pytest.mark.django_db()
+def test_content_relate_plot(imported_proteomes, settings):
+    """Tests whether the KDEs of the helix and sheet content per protein render from the stored results."""
+
+    settings.PPPRINT_RENDER_CACHE = False
+    settings.PPPRINT_PLOT_WORKERS = 1
+    jobs = imported_proteomes(3)
+    vj = VisualizationJob.objects.create()
+    vj.sources.set(jobs)
+
+    run(vj.pk, {ij.pk: load(ij.pk) for ij in jobs}, [PContentRelatePlotReprof])
+
+    assert not vj.messages.exists()
+    assert (get_visualization_folder(vj.pk) / f"{PContentRelatePlotReprof.FILE_NAME}.png").exists()
+
+
+@pytest.mark.django_db()
+def test_plot_tasks_error_callback(settings):
+    """Tests whether the plot tasks of a comparison are dispatched with an error callback failing it."""
+
+    settings.PPPRINT_RENDER_CACHE = False
+    settings.PPPRINT_LAZY_RENDERING = True
+    settings.PPPRINT_PLOT_TASKS = True
+    vj = VisualizationJob.objects.create()
+
+    with patch("ppprint.tasks.chord") as mock_chord:
+        run_visualization_job(vj.pk)
+
+    body = mock_chord.return_value.call_args.args[0]
+    assert [errback.task for errback in body.options["link_error"]] == ["fail_plots"]
+    assert list(body.options["link_error"][0].args) == [vj.pk, "overview", True]
+
+
+@pytest.mark.django_db()
+def test_plot_tasks_dispatch_failure(settings):
+    """Tests whether a comparison failing before its plot tasks are dispatched releases its view."""
+
+    settings.PPPRINT_LAZY_RENDERING = True
+    settings.PPPRINT_PLOT_TASKS = True
+    vj = VisualizationJob.objects.create()
+
+    with patch("ppprint.tasks.pending_plots", side_effect=OSError("disk full")):
+        with pytest.raises(OSError):
+            run_visualization_job(vj.pk)
+
+    vj.refresh_from_db()
+    assert vj.status == StatusChoices.FAILURE
+    assert not view_marker(vj.pk, "overview", "rendering").exists()
+
+
+@pytest.mark.django_db()
+def test_fail_plots():
+    """Tests whether the error callback of the plot tasks fails the comparison and finishes its view."""
+
+    vj = VisualizationJob.objects.create()
+    assert claim_view(vj.pk, "overview")
+
+    fail_plots(None, RuntimeError("worker lost"), None, vj.pk, "overview", True)
+
+    vj.refresh_from_db()
+    assert vj.status == StatusChoices.FAILURE
+    assert vj.messages.filter(text="Could not create plots.").exists()
+    assert not view_marker(vj.pk, "overview", "rendering").exists()
+    assert view_marker(vj.pk, "overview", "rendered").exists()
+
+
+def test_spectrum_observed_proteomes(tmp_path):
+    """Tests whether proteomes of a comparison without any regions are left out of the spectrum."""
+
+    df_points = pd.DataFrame(
+        {
+            "x": [-0.1, -0.2, -0.3],
+            "y": [0.5, 0.5, 0.25],
+            # The proteome column of concatenated proteomes has all of them as categories
+            "proteome": pd.Categorical([1, 1, 3], categories=[1, 2, 3]),
+        }
+    )
+
+    df_grouped = RSpectrumPlotMdisorder({}, {}, tmp_path).group_and_metrics(df_points)
+
+    assert sorted(df_grouped["proteome"].unique()) == [1, 3]
+    assert len(df_grouped) == 2 * 101
+
+
+@pytest.mark.django_db()
+def test_claim_finished_view():
+    """Tests whether a view finished while claiming it is not claimed, instead of failing on the vanished marker."""
+
+    vj = VisualizationJob.objects.create()
+    marker = view_marker(vj.pk, "overview", "rendering")
+    marker.touch()
+
+    def finish(*args, **kwargs):
+        # The rendering finishes right after the marker was found, as `finish_view` does
+        view_marker(vj.pk, "overview", "rendered").write_text("")
+        marker.unlink()
+        raise FileExistsError
+
+    with patch("ppprint.visualization.run.os.open", side_effect=finish):
+        assert not claim_view(vj.pk, "overview")
+    assert not marker.exists()
+
+
+@pytest.mark.django_db()
+def test_visualization_job_claimed_view(settings):
+    """Tests whether a comparison whose view is claimed by another task leaves the view to it."""
+
+    settings.PPPRINT_LAZY_RENDERING = True
+    settings.PPPRINT_BACKGROUND_RENDERING = False
+    vj = VisualizationJob.objects.create()
+    assert claim_view(vj.pk, "overview")
+
+    with patch("ppprint.tasks.render_deferred") as mock_deferred, patch("ppprint.tasks.run") as mock_run:
+        run_visualization_job(vj.pk)
+
+    mock_deferred.assert_not_called()
+    mock_run.assert_not_called()
+    vj.refresh_from_db()
+    assert vj.status == StatusChoices.SUCCESS
+    assert view_marker(vj.pk, "overview", "rendering").exists()
+
+
+@pytest.mark.django_db()
+def test_detail_missing_job(client, settings):
+    """Tests whether requesting a view of a missing comparison neither creates its folder nor renders it."""
+
+    settings.PPPRINT_LAZY_RENDERING = True
+    pk = VisualizationJob.objects.create().pk + 1
+
+    with patch("ppprint.views.render_view.delay") as mock_render:
+        response = client.get(f"/visualization/{pk}")
+
+    assert response.status_code == HTTPStatus.NOT_FOUND
+    mock_render.assert_not_called()
+    assert not (Path(settings.BASE_DIR) / settings.MEDIA_ROOT / "visualization_job" / str(pk)).exists()
+
+
+def test_grid_indices():
+    """Tests whether points are rounded onto the grid as rounding each of them to 2 decimals does."""
+
+    rng = np.random.default_rng(0)
+    lengths = np.arange(1, 500)
+    points = np.concatenate(
+        [
+            rng.random(10000),
+            # Positions within proteins of various lengths, as float32 and float64
+            np.concatenate([np.arange(1, n + 1) / n for n in lengths]).astype(np.float32).astype(np.float64),
+            np.concatenate([np.arange(1, n + 1) / n for n in lengths]),
+            # Points halfway between two grid points, and their neighbors
+            (np.arange(100) + 0.5) / 100,
+            np.nextafter((np.arange(100) + 0.5) / 100, 0),
+            np.nextafter((np.arange(100) + 0.5) / 100, 1),
+            [0.0, 1.0],
+        ]
+    )
+
+    expected = [round(round(x, 2) * 100) for x in points.tolist()]
+    assert grid_indices(points).tolist() == expected
+
+
+def test_point_coverage(tmp_path):
+    """Tests whether the point coverage matches counting the grid points of every region one by one."""
+
+    rng = np.random.default_rng(0)
+    begins = rng.random(500)
+    df = pd.DataFrame(
+        {
+            "point begin": begins.astype(np.float32),
+            "point end": (begins + rng.random(500) * (1 - begins)).astype(np.float32),
+            "proteome": pd.Categorical(rng.choice([1, 2], 500)),
+            "description": rng.choice(["Helix", "Strand"], 500),
+        }
+    )
+    # A single point and a region covering the whole protein
+    df.loc[0, ["point begin", "point end"]] = [0.5, 0.5]
+    df.loc[1, ["point begin", "point end"]] = [0.0, 1.0]
+
+    counts = {}
+    for begin, end, proteome, description in df.itertuples(index=False):
+        for point in range(round(round(begin, 2) * 100), round(round(end, 2) * 100) + 1):
+            key = (proteome, description)
+            counts.setdefault(key, {})
+            counts[key][point] = counts[key].get(point, 0) + 1
+
+    df_coverage = RPointLinePlotReprof({}, {}, tmp_path).point_coverage(df, ["proteome", "description"])
+
+    assert len(df_coverage) == sum(len(points) for points in counts.values())
+    for point, proteome, description, value in df_coverage.itertuples(index=False):
+        points = counts[(proteome, description)]
+        assert value == pytest.approx(points[round(point * 100)] / sum(points.values()))
+
+
+def random_regions(rng, n: int) -> pd.DataFrame:
+    """Returns `n` random regions of a few short proteins in two proteomes."""
+
+    begins = rng.integers(1, 40, n)
+    return pd.DataFrame(
+        {
+            "proteome": pd.Categorical(rng.choice([3, 7], n), categories=[3, 7]),
+            "protein": rng.integers(0, 4, n),
+            "begin": begins,
+            "end": begins + rng.integers(0, 12, n),
+        }
+    )
+
+
+def test_overlaps():
+    """Tests whether the overlaps of regions match comparing every pair of regions of the same protein."""
+
+    rng = np.random.default_rng(0)
+    touching = pd.DataFrame({"proteome": [3, 3, 7], "protein": [0, 0, 0], "begin": [1, 10, 5], "end": [5, 12, 5]})
+    cases = [(random_regions(rng, rng.integers(0, 30)), random_regions(rng, rng.integers(0, 30))) for _ in range(100)]
+    cases += [
+        # Regions touching at a single residue, and a region of the same protein number in another proteome
+        (
+            touching,
+            pd.DataFrame({"proteome": [3, 3, 3], "protein": [0, 0, 1], "begin": [5, 13, 1], "end": [10, 20, 30]}),
+        ),
+        (touching, touching.iloc[:0]),
+        (touching.iloc[:0], touching),
+    ]
+
+    for df_a, df_b in cases:
+        expected = [
+            (a, b, min(ra.end, rb.end) - max(ra.begin, rb.begin) + 1)
+            for a, ra in enumerate(df_a.itertuples())
+            for b, rb in enumerate(df_b.itertuples())
+            if (ra.proteome, ra.protein) == (rb.proteome, rb.protein) and ra.begin <= rb.end and rb.begin <= ra.end
+        ]
+
+        pairs = overlap_pairs(df_a, df_b)
+        assert sorted(pairs.itertuples(index=False, name=None)) == sorted(expected)
+        assert count_overlaps(df_a, df_b).tolist() == [sum(a == i for a, _, _ in expected) for i in range(len(df_a))]
+        assert overlap_residues(df_a, df_b).tolist() == [
+            sum(residues for a, _, residues in expected if a == i) for i in range(len(df_a))
+        ]
+
+    # The touching regions each share a single residue
+    assert overlap_residues(*cases[-3]).tolist() == [1, 1, 0]
+
+
+@pytest.mark.django_db()
+def test_render_cache(imported_proteomes, settings):
+    """Tests whether a second comparison of the same proteomes links the cached image instead of rendering it."""
+
+    settings.PPPRINT_RENDER_CACHE = True
+    settings.PPPRINT_PLOT_WORKERS = 1
+    jobs = imported_proteomes(2)
+    images = []
+    for rendered in [True, False]:
+        vj = VisualizationJob.objects.create()
+        vj.sources.set(jobs)
+        with patch("ppprint.visualization.run.run_plotting", wraps=run_plotting) as mock_plotting:
+            run(vj.pk, {ij.pk: load(ij.pk) for ij in jobs}, [PContentRelatePlotReprof])
+        assert mock_plotting.called == rendered
+        images.append(get_visualization_folder(vj.pk) / f"{PContentRelatePlotReprof.FILE_NAME}.png")
+
+    assert images[0].read_bytes() == images[1].read_bytes()
+    assert get_render_path(PContentRelatePlotReprof, get_mapping(vj)).exists()
+
+
+def test_render_cache_eviction(settings):
+    """Tests whether the least recently used images are evicted once the cache exceeds its budget."""
+
+    folder = get_render_cache_folder()
+    folder.mkdir(parents=True)
+    for i, name in enumerate(["b", "a", "c"]):
+        (folder / f"{name}.png").write_bytes(bytes(100))
+        os.utime(folder / f"{name}.png", (i, i))
+    # Images being added are not counted
+    (folder / f".d.png.{os.getpid()}").write_bytes(bytes(1000))
+
+    evict(300)
+    assert sorted(p.name for p in folder.glob("*.png")) == ["a.png", "b.png", "c.png"]
+    evict(250)
+    assert sorted(p.name for p in folder.glob("*.png")) == ["a.png", "c.png"]
+    evict(0)
+    assert not list(folder.glob("*.png"))
+
+
+def test_bin_proteomes():
+    """Tests whether binning all proteomes at once counts as `np.histogram` does for each proteome."""
+
+    rng = np.random.default_rng(0)
+    values = np.append(rng.normal(0.5, 0.4, 1000), [0.0, 1.0, np.nan])
+    df = pd.DataFrame({"proteome": pd.Categorical(rng.choice([4, 2, 9], len(values))), "value": values})
+    bins = [0.0, 0.1, 0.5, 0.75, 1.0]
+
+    binned = bin_proteomes(df, "value", bins)
+
+    assert binned.proteomes == [2, 4, 9]
+    for i, proteome in enumerate(binned.proteomes):
+        x = df.loc[df["proteome"] == proteome, "value"]
+        assert binned.counts[i].tolist() == np.histogram(x, bins=bins)[0].tolist()
+        assert binned.totals[i] == len(x)
+
+
+def test_divergence_matrices():
+    """Tests whether the divergence matrices match computing the divergence of every pair of proteomes."""
+
+    rng = np.random.default_rng(0)
+    cases = [
+        rng.dirichlet(np.ones(8), 5),
+        # Empty bins and a single proteome
+        np.array([[0.5, 0.5, 0.0], [0.0, 0.2, 0.8]]),
+        np.ones((1, 4)) / 4,
+    ]
+    for distributions in cases:
+        p = smoothed(distributions)
+        n = len(p)
+        m = [[(p[i] + p[j]) / 2 for j in range(n)] for i in range(n)]
+        kl = [[entropy(p[i], p[j]) for j in range(n)] for i in range(n)]
+        js = [[(entropy(p[i], m[i][j]) + entropy(p[j], m[i][j])) / 2 for j in range(n)] for i in range(n)]
+        hellinger = [[np.sqrt(((np.sqrt(p[i]) - np.sqrt(p[j])) ** 2).sum() / 2) for j in range(n)] for i in range(n)]
+
+        np.testing.assert_allclose(kl_matrix(distributions), kl, atol=1e-9)
+        np.testing.assert_allclose(js_matrix(distributions), js, atol=1e-9)
+        np.testing.assert_allclose(hellinger_matrix(distributions), hellinger, atol=1e-6)
+
+
+def test_cross_correlation_matrix():
+    """Tests whether all pairs of series are cross-correlated as `np.correlate` does."""
+
+    rng = np.random.default_rng(0)
+    for length in [1, 6, 7]:
+        series = rng.random((3, length))
+        expected = [[np.correlate(a, b, "same") for b in series] for a in series]
+        np.testing.assert_allclose(cross_correlation_matrix(series), expected, atol=1e-9)
+
+
+def test_cluster_order():
+    """Tests whether similar proteomes are placed next to each other, and few or infinite distances keep the order."""
+
+    # Two groups of similar proteomes, interleaved
+    positions = np.array([0.0, 10.0, 0.1, 10.1, 0.2])
+    order = cluster_order(np.abs(positions[:, None] - positions[None, :]))
+    assert sorted(order) == [0, 1, 2, 3, 4]
+    groups = [position > 5 for position in positions[order]]
+    assert groups in ([False] * 3 + [True] * 2, [True] * 2 + [False] * 3)
+
+    assert cluster_order(np.zeros((1, 1))).tolist() == [0]
+    assert cluster_order(np.array([[0.0, 1.0], [1.0, 0.0]])).tolist() == [0, 1]
+    assert cluster_order(np.array([[0.0, np.inf, 1.0], [1.0, 0.0, 1.0], [1.0, 1.0, 0.0]])).tolist() == [0, 1, 2]
@@ -1,8 +1,15 @@
+import json
 import os
+from pathlib import Path
+
 import pandas as pd
 
 import numpy as np
 
+from ppprint.preprocessing.parse import parse_proteome
+from ppprint.preprocessing.utils import LoggedException
+
+
 def build_true_segments_json():
     """Manually build ground truth JSON from PredictProtein output files."""
 
@@ -143,10 +150,10 @@ def build_true_dfs_pbased():
     df.loc[1] = [0, 0, 0, 70, 0]
     df = df.astype(
         {
-            "number of regions": "int64",
-            "median length": "float64",
-            "sum region lengths": "int64",
-            "protein length": "int64",
+            "number of regions": "int32",
+            "median length": "float32",
+            "sum region lengths": "int32",
+            "protein length": "int32",
             "region content": "float64",
         }
     )
@@ -208,16 +215,16 @@ def build_true_dfs_pbased():
     ]
     df = df.astype(
         {
-            "number of regions": "int64",
-            "median length": "float64",
-            "sum region lengths": "int64",
-            "protein length": "int64",
-            "shift size": "int64",
+            "number of regions": "int32",
+            "median length": "float32",
+            "sum region lengths": "int32",
+            "protein length": "int32",
+            "shift size": "int32",
             "region content": "float64",
             "I": "float64",
             "O": "float64",
             "M": "float64",
-            "orientation": "str",
+            "orientation": "category",
         }
     )
     results["tmseg pbased"] = df
@@ -257,17 +264,17 @@ def build_true_dfs_pbased():
     df.loc[1] = [0, 0, 0, 70, 0, 0, 0, 0, 0, 0, 0]
     df = df.astype(
         {
-            "number of regions": "int64",
-            "median length": "float64",
-            "sum region lengths": "int64",
-            "protein length": "int64",
+            "number of regions": "int32",
+            "median length": "float32",
+            "sum region lengths": "int32",
+            "protein length": "int32",
             "region content": "float64",
             "DBR content": "float64",
             "PBR content": "float64",
             "RBR content": "float64",
-            "num DBR": "int64",
-            "num PBR": "int64",
-            "num RBR": "int64",
+            "num DBR": "int32",
+            "num PBR": "int32",
+            "num RBR": "int32",
         }
     )
     results["prona pbased"] = df
@@ -302,10 +309,10 @@ def build_true_dfs_pbased():
     df.loc[1] = [0, 0, 0, 70, 0, 0, 0, 0]
     df = df.astype(
         {
-            "number of regions": "int64",
-            "median length": "float64",
-            "sum region lengths": "int64",
-            "protein length": "int64",
+            "number of regions": "int32",
+            "median length": "float32",
+            "sum region lengths": "int32",
+            "protein length": "int32",
             "region content": "float64",
             "H": "float64",
             "O": "float64",
@@ -327,10 +334,12 @@ def build_true_dfs_rbased():
         df = pd.DataFrame(
             columns=[
                 "protein",
-                "region",
+                "begin",
+                "end",
                 "reg length",
                 "description",
-                "point region",
+                "point begin",
+                "point end",
                 "protein length",
                 "rel reg length",
             ]
@@ -338,33 +347,39 @@ def build_true_dfs_rbased():
 
         if feature == "mdisorder":
             # Mdisorder
-            df.loc[0] = [0, np.array((1, 30)), 30, "Disordered Region", np.array((1 / 60, 0.5)), 60, 0.5]
+            df.loc[0] = [0, 1, 30, 30, "Disordered Region", 1 / 60, 0.5, 60, 0.5]
         elif feature == "tmseg":
             # Tmseg
             df.loc[0] = [
                 0,
-                np.array((13, 24)),
+                13,
+                24,
                 12,
                 "Transmembrane Helix",
-                np.array((13 / 60, 24 / 60)),
+                13 / 60,
+                24 / 60,
                 60,
                 0.2,
             ]
             df.loc[1] = [
                 1,
-                np.array((1, 12)),
+                1,
+                12,
                 12,
                 "Transmembrane Helix",
-                np.array((1 / 60, 12 / 60)),
+                1 / 60,
+                12 / 60,
                 60,
                 0.2,
             ]
             df.loc[2] = [
                 1,
-                np.array((17, 28)),
+                17,
+                28,
                 12,
                 "Transmembrane Helix",
-                np.array((17 / 60, 28 / 60)),
+                17 / 60,
+                28 / 60,
                 60,
                 0.2,
             ]
@@ -372,30 +387,62 @@ def build_true_dfs_rbased():
             # Prona
             df.loc[0] = [
                 0,
-                np.array((1, 6)),
+                1,
+                6,
                 6,
                 "Protein Binding (RI: 67-100)",
-                np.array((1 / 60, 0.1)),
+                1 / 60,
+                0.1,
                 60,
                 0.1,
             ]
         else:
             # Reprof
-            df.loc[0] = [0, np.array((1, 10)), 10, "Helix", np.array((1 / 60, 1 / 6)), 60, 1 / 6]
-            df.loc[1] = [0, np.array((11, 20)), 10, "Strand", np.array((11 / 60, 1 / 3)), 60, 1 / 6]
+            df.loc[0] = [0, 1, 10, 10, "Helix", 1 / 60, 1 / 6, 60, 1 / 6]
+            df.loc[1] = [0, 11, 20, 10, "Strand", 11 / 60, 1 / 3, 60, 1 / 6]
 
         df = df.astype(
             {
-                "protein": "int64",
-                #"region": "float64",
-                "reg length": "int64",
-                "description": "str",
-                #"point region": "float64",
-                "protein length": "int64",
-                "rel reg length": "float64",
+                "protein": "int32",
+                "begin": "int32",
+                "end": "int32",
+                "reg length": "int32",
+                "description": "category",
+                "point begin": "float32",
+                "point end": "float32",
+                "protein length": "int32",
+                "rel reg length": "float32",
             }
         )
 
         results[f"{feature} rbased"] = df
 
     return results
+
+
+def write_json(base_path: Path, out_file: Path, import_job_pk: int):
+    """Writes a JSON file for a given proteome, in the intermediate format of imports before the columnar one."""
+
+    proteins = parse_proteome(base_path, import_job_pk)
+
+    json.JSONEncoder(ensure_ascii=False, check_circular=False)
+    with open(out_file, "w") as f:
+        # We have to store everything in a list to make the json encoder happy :(
+        # (Actually we don't have to, but it's required on loading anyways)
+        data = [
+            {
+                "sequence": sequence,
+                "tmseg": tmseg,
+                "prona": prona,
+                "mdisorder": mdisorder,
+                "reprof": reprof,
+            }
+            for sequence, tmseg, prona, mdisorder, reprof in proteins
+        ]
+
+        if len(data) == 0:
+            m = "Could not find any proteins. Make sure to check required data structure within the archive."
+            raise LoggedException(m)
+        else:
+            for chunk in json.JSONEncoder().iterencode(data):
+                f.write(chunk)